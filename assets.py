@@ -0,0 +1,127 @@
+"""
+Loading game assets in background threads, and caching preprocessed assets on disk.
+"""
+
+import os
+import time
+import hashlib
+import threading
+
+
+# change when format of cached data changes, old cache entries are then ignored
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'snake')
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+class AssetLoader:
+    """Loads assets in a thread pool, every asset once by key.
+    get() blocks only if the asset is not loaded yet.
+    Seconds spent loading every asset are recorded in load_times.
+    """
+    def __init__(self, max_workers=4):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='assets')
+        self.futures = {}
+        self.load_times = {}
+
+    def load(self, key, func, *args):
+        """Start loading asset with func(*args) unless already started, return future."""
+        if key not in self.futures:
+            self.futures[key] = self.executor.submit(self._timed, key, func, *args)
+        return self.futures[key]
+
+    def _timed(self, key, func, *args):
+        start = time.perf_counter()
+        asset = func(*args)
+        self.load_times[key] = time.perf_counter() - start
+        return asset
+
+    def get(self, key):
+        """Loaded asset, wait for it if needed."""
+        return self.futures[key].result()
+
+
+class DiskCache:
+    """Preprocessed assets stored as files in a versioned cache directory.
+    Entries are keyed by hash of key parts, usually including hash of the source file
+    and the sizes that the asset was prepared for. Every entry is read in one bulk read.
+    """
+    def __init__(self, path=CACHE_DIR, version=CACHE_VERSION):
+        self.path = os.path.join(path, f'v{version}')
+        self._file_hashes = {}
+
+    def key(self, *parts):
+        """Cache key from parts: bytes, or anything with a stable repr()."""
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else repr(part).encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def file_hash(self, filename):
+        """Hash of file contents, computed once per file."""
+        if filename not in self._file_hashes:
+            self._file_hashes[filename] = hashlib.sha1(read_bytes(filename)).hexdigest()
+        return self._file_hashes[filename]
+
+    def file_key(self, filename, *parts):
+        """Cache key from contents of source file and other parts."""
+        return self.key(self.file_hash(filename), *parts)
+
+    def get(self, key):
+        """Cached bytes, or None if not in cache."""
+        try:
+            return read_bytes(os.path.join(self.path, key))
+        except OSError:
+            return None
+
+    def put(self, key, data):
+        """Store bytes in cache. Failure to write is ignored, cache is an optimization."""
+        path = os.path.join(self.path, key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            # atomic, concurrent readers never see a partial file
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def cached(self, key, build):
+        """Cached bytes, or bytes from build() that are also stored in cache."""
+        data = self.get(key)
+        if data is None:
+            data = build()
+            self.put(key, data)
+        return data
+
+
+def test_AssetLoader():
+    loader = AssetLoader()
+    calls = []
+    def load(x):
+        calls.append(x)
+        return x * 2
+    loader.load('a', load, 1)
+    loader.load('a', load, 1)
+    assert loader.get('a') == 2
+    assert calls == [1]
+    assert set(loader.load_times) == {'a'}
+
+
+def test_DiskCache(tmp_path):
+    cache = DiskCache(tmp_path)
+    src = tmp_path / 'src.txt'
+    src.write_bytes(b'abc')
+    key = cache.file_key(str(src), (32, 32))
+    assert key != cache.file_key(str(src), (16, 16))
+    assert cache.get(key) is None
+    assert cache.cached(key, lambda: b'data') == b'data'
+    assert cache.cached(key, lambda: b'other') == b'data'
+    assert DiskCache(tmp_path, CACHE_VERSION + 1).get(key) is None
@@ -0,0 +1,230 @@
+"""
+Many snake games advanced in lockstep with NumPy.
+
+Same rules as engine.Engine, but all state lives in arrays with one row per
+game, and BatchEngine.step() advances every game with a fixed number of
+vectorized operations. Used to collect bot training data at high throughput.
+With 16384 games on the default 15x15 board, that is about 5-6M game-steps/s with
+random actions, which lose and restart a third of the games on every step, and 3M
+going straight, with every game restarted (python bench.py -k batch).
+
+Requires numpy (pip install numpy).
+"""
+
+import numpy as np
+
+import gridlib
+
+
+DIRS = 'nesw'
+# step results, index into RESULTS, WIN and above end the game
+MOVE, GOOD, BAD, LEVEL_UP, WIN, SELF, WALL, SIZE_ZERO = range(8)
+RESULTS = ('move', 'good', 'bad', 'level_up', 'win', 'self', 'wall', 'size_zero')
+# occupancy values: apple in slot j is stored as APPLE + j
+EMPTY, SNAKE, APPLE = 0, 1, 2
+# occupancy of the extra cell after every grid row, that steps into a wall lead to
+WALL_CELL = 255
+
+
+def neighbor_table(grid):
+    """Array of shape (4, w * h): cell reached from every cell in every direction of DIRS.
+    -1 where the step would hit a wall.
+    """
+    return np.array([grid.neighbors[d] for d in DIRS], np.int64)
+
+
+class BatchEngine:
+    """N independent games stored as arrays.
+
+    occ - (n, cells) occupancy grid, EMPTY, SNAKE or APPLE + slot
+    head - (n,) head cells
+    body - (n, cap) ring buffer of body cells, head at body[i, head_ptr[i]],
+    followed by length[i] - 1 segments towards the tail
+    apples - (n, good_apples + bad_apples) apple cells, good apples first
+    size, score, level - game stats
+
+    Games that are lost or won are restarted, and finished levels are followed
+    by the next level, all within the same step() call.
+    """
+    def __init__(self, n, grid, start_size, win_size, win_level, good_apples, bad_apples, seed=None):
+        cells = grid.w * grid.h
+        if start_size > grid.h:
+            raise ValueError(f'Snake of size {start_size} does not fit in grid height {grid.h}')
+        if win_size + good_apples + bad_apples > cells:
+            raise ValueError('Not enough cells for snake of win_size and all apples')
+        self.n = n
+        self.grid = grid
+        self.cells = cells
+        self.start_size = start_size
+        self.win_size = win_size
+        self.win_level = win_level
+        self.rng = np.random.default_rng(seed)
+        self.neighbors = neighbor_table(grid)
+        self.apple_good = np.array([True] * good_apples + [False] * bad_apples)
+        # new snake at (0, 0) facing north, body going south
+        self.start_body = np.arange(start_size) * grid.w
+        self._start_free = np.setdiff1d(np.arange(cells), self.start_body)
+        # ring buffer capacity is a power of two, so that pointers wrap with bitwise and
+        cap = 1 << (win_size + 1).bit_length()
+        self._mask = cap - 1
+
+        # rows have one more cell for the wall, so that stepping into it is looked up
+        # like any other cell, occ is a view without it
+        stride = cells + 1
+        self._grid_occ = np.zeros((n, stride), np.uint8)
+        self.occ = self._grid_occ[:, :cells]
+        # small dtypes keep the arrays in cache
+        cell_dtype = np.int16 if stride <= np.iinfo(np.int16).max else np.int32
+        index_dtype = np.int32 if n * max(stride, cap) <= np.iinfo(np.int32).max else np.int64
+        self.body = np.zeros((n, cap), cell_dtype)
+        self.head = np.zeros(n, np.int32)
+        self.head_ptr = np.zeros(n, np.int32)
+        self.length = np.zeros(n, np.int32)
+        self.facing = np.zeros(n, np.int32)
+        self.apples = np.zeros((n, len(self.apple_good)), np.int32)
+        self.size = np.zeros(n, np.int64)
+        self.score = np.zeros(n, np.int64)
+        self.level = np.zeros(n, np.int64)
+        # flat views, row offsets and lookup tables for fast element access
+        self._occ = self._grid_occ.reshape(-1)
+        self._body = self.body.reshape(-1)
+        self._row = np.arange(n, dtype=index_dtype) * stride
+        self._body_row = np.arange(n, dtype=index_dtype) * cap
+        self._neighbors = np.where(self.neighbors < 0, cells, self.neighbors).reshape(-1).astype(np.int32)
+        self._tag_result = np.full(256, BAD, np.int8)
+        self._tag_result[EMPTY] = MOVE
+        self._tag_result[SNAKE] = SELF
+        self._tag_result[APPLE:APPLE + good_apples] = GOOD
+        self._tag_result[WALL_CELL] = WALL
+        # row of a new level without apples; copying whole rows of small grids is cheaper
+        # than clearing the cells in use one by one
+        self._start_row = np.zeros(stride, np.uint8)
+        self._start_row[self.start_body] = SNAKE
+        self._start_row[cells] = WALL_CELL
+        self._copy_rows = stride <= 16 * (cap + len(self.apple_good))
+        self.reset()
+
+    def reset(self, games=None):
+        """Start new games, all or given indices."""
+        if games is None:
+            games = np.arange(self.n)
+        self.score[games] = 0
+        self.level[games] = 1
+        self._new_level(games)
+
+    def _new_level(self, games):
+        row = self._row[games, None]
+        if self._copy_rows:
+            self._grid_occ[games] = self._start_row
+        else:
+            # cells in use are all in the body ring buffer or under apples, stale buffer
+            # entries are old cells of the same game
+            self._occ[(row + self.body[games]).reshape(-1)] = EMPTY
+            self._occ[(row + self.apples[games]).reshape(-1)] = EMPTY
+            self._occ[(row + self.start_body).reshape(-1)] = SNAKE
+            self._occ[row[:, 0] + self.cells] = WALL_CELL
+        self.size[games] = self.start_size
+        self.body[games, :self.start_size] = self.start_body
+        self.head[games] = self.start_body[0]
+        self.head_ptr[games] = 0
+        self.length[games] = self.start_size
+        self.facing[games] = 0
+        # every level starts from the same cells: slot j takes pick j of the empty cells
+        # left by slots before it, shifted past those slots' picks from the last one back
+        n_apples = len(self.apple_good)
+        free = self._start_free
+        bound = len(free) - np.arange(n_apples)
+        pick = (self.rng.random((n_apples, len(games))) * bound[:, None]).astype(free.dtype)
+        cell = pick.copy()
+        for slot in range(n_apples - 2, -1, -1):
+            cell[slot + 1:] += cell[slot + 1:] >= pick[slot]
+        cell = free[cell]
+        for slot in range(n_apples):
+            self._occ[row[:, 0] + cell[slot]] = APPLE + slot
+        self.apples[games] = cell.T
+
+    def _place_apples(self, games, slots):
+        """Move apples in slots of games to random empty cells, one slot per game."""
+        row = self._row[games]
+        cell = row + self.rng.integers(0, self.cells, len(games))
+        # cells drawn on the snake or another apple: random one of the empty cells of the game
+        miss = np.flatnonzero(self._occ[cell] != EMPTY)
+        if len(miss):
+            count = np.cumsum(self.occ[games[miss]] == EMPTY, axis=1)
+            pick = self.rng.integers(0, count[:, -1])
+            cell[miss] = row[miss] + (count > pick[:, None]).argmax(axis=1)
+        self._occ[cell] = APPLE + slots
+        self.apples[games, slots] = cell - row
+
+    def _drop_tail(self, games):
+        """Remove last segment of snakes in given games."""
+        tail_ptr = (self.head_ptr[games] + self.length[games] - 1) & self._mask
+        tail = self._body[self._body_row[games] + tail_ptr]
+        self._occ[self._row[games] + tail] = EMPTY
+        self.length[games] -= 1
+
+    def step(self, actions=None):
+        """Turn every snake to its action (index in DIRS, -1 to keep going), move them all.
+        Return array of results, indices into RESULTS.
+        """
+        facing = self.facing
+        if actions is not None:
+            actions = np.asarray(actions)
+            turn = (actions >= 0) & (actions != (facing + 2) & 3)
+            facing = self.facing = np.where(turn, actions, facing)
+
+        row = self._row
+        new = self._neighbors[facing * self.cells + self.head]
+        cell = row + new
+        tag = self._occ[cell]
+        result = self._tag_result[tag]
+
+        # advance all games, lost games are reset below anyway
+        self.head = new
+        self.head_ptr = (self.head_ptr - 1) & self._mask
+        self._body[self._body_row + self.head_ptr] = new
+        self._occ[cell] = SNAKE
+        # normal move drops the tail, good apple keeps it, bad apple drops two segments
+        tail = row + self._body[self._body_row + ((self.head_ptr + self.length) & self._mask)]
+        self._occ[tail] = EMPTY
+        grown = np.flatnonzero(result == GOOD)
+        self._occ[tail[grown]] = SNAKE
+        self.length[grown] += 1
+        self.size[grown] += 1
+        self.score[grown] += self.level[grown]
+        bad = np.flatnonzero(result == BAD)
+        one_seg = self.length[bad] == 1
+        result[bad[one_seg]] = SIZE_ZERO
+        shrunk = bad[~one_seg]
+        self._drop_tail(shrunk)
+        self.size[shrunk] -= 1
+
+        done = self.length[grown] == self.win_size
+        eaten = np.concatenate((grown[~done], shrunk))
+        self._place_apples(eaten, tag[eaten].astype(np.int64) - APPLE)
+        done = grown[done]
+        won = self.level[done] == self.win_level
+        result[done[won]] = WIN
+        next_level = done[~won]
+        if len(next_level):
+            result[next_level] = LEVEL_UP
+            self.level[next_level] += 1
+            self._new_level(next_level)
+        over = np.flatnonzero(result >= WIN)
+        if len(over):
+            self.reset(over)
+        return result
+
+
+def test_batch():
+    grid = gridlib.Grid(15, 15)
+    batch = BatchEngine(64, grid, 3, 10, 10, 1, 5, seed=0)
+    rng = np.random.default_rng(1)
+    for _ in range(500):
+        batch.step(rng.integers(-1, 4, batch.n))
+        assert ((batch.occ == SNAKE).sum(axis=1) == batch.length).all()
+        assert (batch.length == batch.size).all()
+        apple_tags = np.take_along_axis(batch.occ, batch.apples, axis=1)
+        assert (apple_tags == APPLE + np.arange(6)).all()
+        assert ((batch.occ != EMPTY).sum(axis=1) == batch.length + 6).all()
+        assert (batch.head == batch.body[np.arange(batch.n), batch.head_ptr]).all()
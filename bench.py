@@ -0,0 +1,425 @@
+"""
+Benchmarks of engine, rendering, text, music and startup.
+
+python bench.py                    - run all, save results to bench_results.json
+python bench.py -k render          - run benchmarks with "render" in name
+python bench.py --save-baseline    - also store results as the baseline
+Results are compared with the baseline (bench_baseline.json) if it exists,
+and benchmarks that got slower by more than the tolerance are flagged.
+Every result is seconds per operation, lower is better.
+
+Runs headless with SDL dummy drivers. Game rendering and startup need the
+assets folder in the current directory, like the game itself.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+
+# before pygame is initialized
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import gridlib
+import engine
+import bots
+from profiler import percentile
+from lazy import lazy_import
+
+pygame = lazy_import('pygame')
+mido = lazy_import('mido')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# modules that the headless game logic must not load
+HEAVY_MODULES = ('pygame', 'mido', 'numpy', 'multiprocessing')
+
+
+def measure(func, number, repeat=5):
+    """Best time of func() call in seconds, out of repeat runs of number calls."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+_IMPORT_CODE = '''
+import sys, time, types
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+# lazily imported modules stay in sys.modules as a different type until first used
+heavy = [m for m in {heavy!r} if type(sys.modules.get(m)) is types.ModuleType]
+print(t, ','.join(heavy))
+'''
+
+
+def import_time(module, repeat=5):
+    """Best time in seconds of importing module in a fresh interpreter,
+    and list of heavy modules that the import loaded.
+    """
+    code = _IMPORT_CODE.format(module=module, heavy=HEAVY_MODULES)
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                             text=True, cwd=HERE).stdout.split()
+        t = float(out[0])
+        heavy = out[1].split(',') if len(out) > 1 else []
+        best = t if best is None else min(best, t)
+    return best, heavy
+
+
+def bench_imports():
+    results = {}
+    for module in ('gridlib', 'engine', 'assets', 'text', 'music', 'snake'):
+        results[module], _ = import_time(module)
+    return results
+
+
+def bench_snake_move():
+    """Snake.move() going around a wrapped row, never hitting anything."""
+    results = {}
+    for size in (3, 100, 1000, 10000):
+        grid = gridlib.Grid(2 * size, 1, True)
+        occ = gridlib.Occupancy(grid)
+        snake = engine.Snake(grid, occ, (size - 1, 0), 'e', 1)
+        for _ in range(size - 1):
+            snake._push_head(snake.neighbors['e'][snake.segs[0]])
+        apples = []
+        results[f'size={size}'] = measure(lambda: snake.move(apples), 10000)
+    return results
+
+
+def bench_apple_move():
+    """Apple.move() on 100x100 board with given share of cells occupied."""
+    results = {}
+    for fill in (0, 0.5, 0.9, 0.99):
+        grid = gridlib.Grid(100, 100)
+        occ = gridlib.Occupancy(grid)
+        cells = list(range(grid.w * grid.h))
+        random.Random(0).shuffle(cells)
+        for cell in cells[:int(fill * len(cells))]:
+            occ[cell] = engine.SNAKE
+        apple = engine.Apple(grid, occ, True, engine.APPLE)
+        results[f'fill={fill}'] = measure(apple.move, 10000)
+    return results
+
+
+def bench_autopilot():
+    """Bot act() on 100x100 board with a snake growing to 200, mean and 99th percentile."""
+    results = {}
+    for bot_class in (bots.PathBot, bots.CycleBot):
+        for wrap in (False, True):
+            eng = engine.Engine(gridlib.Grid(100, 100, wrap), 3, 200, 10, 1, 5, seed=0)
+            bot = bot_class(eng)
+            times = []
+            for _ in range(10000):
+                start = time.perf_counter()
+                action = bot.act()
+                times.append(time.perf_counter() - start)
+                result = eng.step(action)
+                if result == 'level_up':
+                    eng.level_up()
+                elif result in ('win', 'self', 'wall', 'size_zero'):
+                    eng.new_game(0)
+            times.sort()
+            name = f'{bot_class.__name__}/{"wrap" if wrap else "walls"}'
+            results[f'{name}/mean'] = sum(times) / len(times)
+            results[f'{name}/p99'] = percentile(times, 99)
+    return results
+
+
+def bench_clone():
+    """Engine.clone() and restore() after 200 safe steps, on the default and a 100x100 board."""
+    results = {}
+    for size in (15, 100):
+        eng = engine.Engine(gridlib.Grid(size, size), 3, 200, 10, 1, 5, seed=0)
+        rng = random.Random(0)
+        for _ in range(200):
+            if eng.step(_safe_action(eng, rng)) in ('win', 'level_up', 'self', 'wall', 'size_zero'):
+                eng.new_game(0)
+        state = eng.clone()
+        results[f'{size}x{size}/clone'] = measure(eng.clone, 10000)
+        results[f'{size}x{size}/restore'] = measure(lambda: eng.restore(state), 10000)
+    return results
+
+
+def bench_batch():
+    """BatchEngine.step() time per game, going straight, so that every game is lost and
+    restarted on each step, and turning at random: 1024 games on the default and a 100x100
+    board, and 16384 games on the default board, also printed as game-steps per second.
+    """
+    import numpy as np
+    import batch
+    results = {}
+    for size, n in ((15, 1024), (100, 1024), (15, 16384)):
+        games = batch.BatchEngine(n, gridlib.Grid(size, size), 3, 10, 10, 1, 5, seed=0)
+        number = 100 if n <= 1024 else 20
+        actions = iter(np.random.default_rng(0).integers(-1, 4, (5 * number, n), np.int8))
+        name = f'{size}x{size}' if n == 1024 else f'{size}x{size}/{n}'
+        results[f'{name}/straight'] = measure(games.step, number) / n
+        results[f'{name}/random'] = measure(lambda: games.step(next(actions)), number) / n
+        if n > 1024:
+            print(f'batch: {n} games on {size}x{size}, {1e-6 / results[f"{name}/straight"]:.1f}M '
+                  f'game-steps/s straight, {1e-6 / results[f"{name}/random"]:.1f}M at random')
+    return results
+
+
+def _set_layout(grid_w, grid_h, tile):
+    import snake
+    snake.configure(GRID_W=grid_w, GRID_H=grid_h, TILE_W=tile, TILE_H=tile)
+
+
+def _safe_action(eng, rng):
+    """Random direction that does not hit a wall or the snake, if there is one."""
+    head = eng.snake.segs[0]
+    dirs = [d for d in 'nesw' if d != eng.snake.backward]
+    rng.shuffle(dirs)
+    dirs.sort(key=lambda d: d != eng.snake.facing)
+    for d in dirs:
+        cell = eng.grid.neighbors[d][head]
+        if cell >= 0 and eng.occ[cell] != engine.SNAKE:
+            return d
+    return None
+
+
+def bench_render():
+    """Game.render() frame time while snake is moving, and full redraw time."""
+    import snake
+    if not os.path.isdir('assets'):
+        print('render: skipped, needs assets folder in current directory')
+        return {}
+    saved = snake.GRID_W, snake.GRID_H, snake.TILE_W
+    results = {}
+    try:
+        for grid_w, grid_h, tile in ((15, 15, 32), (15, 15, 64), (30, 30, 16), (60, 60, 8)):
+            _set_layout(grid_w, grid_h, tile)
+            game = snake.Game()
+            name = f'{grid_w}x{grid_h}x{tile}'
+            results[f'{name}/frame'] = _render_frames(game, snake, 1000)
+            results[f'{name}/full'] = measure(game.render_full, 20)
+    finally:
+        _set_layout(*saved)
+    return results
+
+
+def _render_frames(game, snake, frames):
+    """Make one engine step per frame, return median render time."""
+    rng = random.Random(0)
+
+    def new_game():
+        game.engine.new_game()
+        game.stats = game.engine.stats
+        game.snake = snake.Snake(game.engine.snake, game.stats.level)
+        game.update_status_bar()
+        game.drawn_view = None
+
+    game.state = snake.GameState.RUN
+    new_game()
+    game.render()
+    times = []
+    for _ in range(frames):
+        eng = game.engine
+        head = eng.snake.segs[0]
+        result = eng.step(_safe_action(eng, rng))
+        game.dirty_cells.add(head)
+        game.dirty_cells.update(eng.occ.changed)
+        if result in ('good', 'bad'):
+            game.update_status_bar()
+        elif result != 'move':
+            new_game()
+        start = time.perf_counter()
+        game.render()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[frames // 2]
+
+
+def bench_text_sprite():
+    """TextSprite construction, rendered and from the in-memory cache."""
+    import text
+    pygame.display.set_mode((640, 480))
+    string = 'Move around and eat good apples to grow.\nBad apples ain\'t good.'
+    make = lambda: text.TextSprite(string, (255, 255, 255), rect_size=(600, 200))
+    cache, text.disk_cache = text.disk_cache, None
+    def render():
+        text.text_cache.items.clear()
+        text.text_cache.bytes = 0
+        make()
+    try:
+        return {'render': measure(render, 20), 'cached': measure(make, 1000)}
+    finally:
+        text.disk_cache = cache
+
+
+def _midi_file():
+    """Small MIDI file: a scale with a tempo message."""
+    mid = mido.MidiFile()
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    track.append(mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(120)))
+    for i in range(200):
+        note = 60 + i % 12
+        track.append(mido.Message('note_on', note=note, velocity=64, time=0))
+        track.append(mido.Message('note_off', note=note, velocity=64, time=240))
+    return mid
+
+
+def bench_set_tempo():
+    """MidiMusic.set_tempo() with the tempo variant not built yet, and prepared."""
+    import music
+    try:
+        pygame.mixer.init()
+        m = music.MidiMusic(_midi_file(), max_variants=1000)
+    except pygame.error as e:
+        print(f'set_tempo: skipped, {e}')
+        return {}
+    bpms = iter(range(30, 1000))
+    new = measure(lambda: m.set_tempo(next(bpms)), 20)
+    m.prepare([90, 91])
+    m._variant(91).result()
+    prepared = measure(lambda: m.set_tempo(90 + (m.bpm == 90)), 100)
+    return {'new': new, 'prepared': prepared}
+
+
+_STARTUP_CODE = '''
+import snake
+snake.ASSET_CACHE = {cache}
+game = snake.Game()
+'''
+
+# waits for every asset, prints seconds spent loading each
+_LOAD_TIMES_CODE = _STARTUP_CODE + '''
+import json
+for key in game.assets.futures:
+    game.assets.get(key)
+print(json.dumps(game.assets.load_times))
+'''
+
+
+def bench_startup():
+    """Process start to intro screen shown, with and without asset cache,
+    and time spent loading every asset in the background.
+    """
+    if not os.path.isdir('assets'):
+        print('startup: skipped, needs assets folder in current directory')
+        return {}
+    env = dict(os.environ, PYTHONPATH=HERE + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = {}
+    for name, cache in (('cached', True), ('no_cache', False)):
+        args = [sys.executable, '-c', _STARTUP_CODE.format(cache=cache)]
+        # first run fills the cache
+        subprocess.run(args, check=True, capture_output=True, env=env)
+        results[name] = measure(lambda: subprocess.run(args, check=True, capture_output=True, env=env), 1)
+        code = _LOAD_TIMES_CODE.format(cache=cache)
+        out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                             text=True, env=env).stdout
+        for key, t in json.loads(out.splitlines()[-1]).items():
+            results[f'{name}/{key}'] = t
+    return results
+
+
+BENCHMARKS = {
+    'import': bench_imports,
+    'snake_move': bench_snake_move,
+    'apple_move': bench_apple_move,
+    'autopilot': bench_autopilot,
+    'clone': bench_clone,
+    'batch': bench_batch,
+    'render': bench_render,
+    'text_sprite': bench_text_sprite,
+    'set_tempo': bench_set_tempo,
+    'startup': bench_startup,
+}
+
+
+def run(names):
+    results = {}
+    for name in names:
+        for key, t in BENCHMARKS[name]().items():
+            results[f'{name}/{key}'] = t
+            print(f'{name}/{key}'.ljust(37), f'{t * 1e6:12.2f} us')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print results next to baseline, return names of those slower by more than tolerance."""
+    regressions = []
+    for name, t in results.items():
+        if name not in baseline:
+            continue
+        ratio = t / baseline[name]
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print(f'{name:37} {baseline[name] * 1e6:12.2f} {t * 1e6:12.2f} us  {ratio:5.2f}x  {flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run benchmarks.')
+    parser.add_argument('-k', default='', help='only run benchmarks with this in name')
+    parser.add_argument('--out', default='bench_results.json', help='results file')
+    parser.add_argument('--baseline', default='bench_baseline.json', help='baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='store results as baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    args = parser.parse_args()
+
+    results = run([name for name in BENCHMARKS if args.k in name])
+    report = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print(f'\nCompared with {args.baseline}:')
+        regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+    if regressions:
+        print(f'\n{len(regressions)} regressions')
+        sys.exit(1)
+
+
+def test_import_light():
+    for module in ('engine', 'snake'):
+        _, heavy = import_time(module, repeat=1)
+        assert not heavy, heavy
+
+
+_NO_PACKAGES_CODE = '''
+import sys
+sys.path = [p for p in sys.path if not p.endswith(('site-packages', 'dist-packages'))]
+import {modules}
+import snake
+assert snake.GRID.w == snake.GRID_W
+'''
+
+
+def test_import_without_packages():
+    # game logic is imported without pygame and mido installed, they fail when used
+    code = _NO_PACKAGES_CODE.format(modules='engine, text, music, snake')
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=HERE)
+
+
+def test_compare():
+    assert compare({'a': 1.0, 'b': 1.5, 'c': 1.0}, {'a': 1.0, 'b': 1.0}, 0.2) == ['b']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,696 @@
+"""
+Bots that play the game by choosing snake direction before every step.
+
+    bot = PathBot(eng)
+    while True:
+        result = eng.step(bot.act())
+        ...
+
+A bot is created for an engine.Engine and optional assets.DiskCache to keep data it
+precomputes, and act() returns a direction or None to keep going.
+"""
+
+import math
+import random
+import struct
+
+import gridlib
+import engine
+from engine import SNAKE, APPLE
+
+
+# field cells updated per step, about 0.5 ms
+UPDATE_BUDGET = 500
+# cells counted by PathBot room checks per step, about 0.2 ms
+ROOM_BUDGET = 600
+# change when gridlib.hamiltonian_cycle() changes, cycles in disk cache are then built again
+CYCLE_VERSION = 1
+# snake of one cell keeps out of smaller areas without good apples, it could not get out
+SMALL_ROOM = 8
+# CycleBot shortcuts that leave fewer spare cells ahead than this only go around bad apples,
+# on nearly full grids the snake has too few of them to pass the bad apples otherwise
+SPARE_CELLS = 10
+# MCTSBot: playouts per step, steps of a playout after it leaves the tree,
+# UCB1 exploration constant and discount of apples eaten later in a playout
+PLAYOUTS = 100
+PLAYOUT_DEPTH = 10
+EXPLORATION = 0.25
+DISCOUNT = 0.9
+# share of random moves in playouts, others go for the nearest good apple
+RANDOM_MOVES = 0.2
+
+
+class PathBot:
+    """Autopilot heading for the nearest good apple along a shortest path.
+    Distances to good apples are kept in a gridlib.DistanceField, with snake body and
+    bad apples blocked. The field is updated from cells changed by the last step
+    (occ.changed), so act() must be called before every step.
+    Field updates are limited to about budget cells per step. Until a big change (apple eaten,
+    path cut off) is passed through the whole field, the snake heads to the nearest apple
+    as the crow flies.
+    Moves into an area smaller than twice the snake, that it can not leave by following
+    its tail, are avoided.
+    """
+    def __init__(self, eng, cache=None, budget=UPDATE_BUDGET):
+        self.engine = eng
+        self.budget = budget
+        self.field = gridlib.DistanceField(eng.grid)
+        # raising a distance costs about four times more than lowering it
+        self.field.raise_limit = budget // 4
+        # occupancy the field was built from, new one means new level or restored state
+        self.occ = None
+        self.good_tags = set()
+
+    def _roles(self, value):
+        """(blocked, source) for occupancy value."""
+        if value == SNAKE:
+            return True, False
+        if value >= APPLE:
+            good = value in self.good_tags
+            return not good, good
+        return False, False
+
+    def _rebuild(self):
+        eng = self.engine
+        self.occ = eng.occ
+        self.good_tags = {a.tag for a in eng.apples if a.good}
+        field = self.field
+        table = bytearray(256)
+        for value in range(256):
+            table[value] = self._roles(value)[0]
+        field.blocked = self.occ.cells.translate(table)
+        field.sources = {a.cell for a in eng.apples if a.good and a.cell is not None}
+        field.reset()
+
+    def _sync(self):
+        if self.engine.occ is not self.occ:
+            self._rebuild()
+            return
+        field = self.field
+        # eaten apple is removed before the new one is added: when it was the only source,
+        # distances are dropped at once instead of raised cell by cell
+        gains = []
+        for cell in self.occ.changed:
+            blocked, source = self._roles(self.occ[cell])
+            if not source:
+                field.remove_source(cell)
+            if blocked:
+                field.block(cell)
+            gains.append((cell, blocked, source))
+        for cell, blocked, source in gains:
+            if not blocked:
+                field.unblock(cell)
+            if source:
+                field.add_source(cell)
+
+    def act(self):
+        self._sync()
+        exact = self.field.update(self.budget)
+        eng = self.engine
+        snake = eng.snake
+        head = snake.segs[0]
+        distance = self.field.dist.__getitem__ if exact else self.straight_distance
+        moves = []
+        for d in 'nesw':
+            cell = eng.grid.neighbors[d][head]
+            if d == snake.backward or cell < 0 or self.occ[cell] == SNAKE:
+                continue
+            # nearest to an apple, then not a bad apple, then straight ahead
+            moves.append((distance(cell), self.occ[cell] != engine.EMPTY, d != snake.facing, d, cell))
+        if not moves:
+            return None
+        moves.sort()
+        # room for the body and for every good apple it could eat on the way, twice, since
+        # not every area that big can be gone through without the tail to follow
+        need = 2 * (len(snake) + eng.good_apples + 1)
+        rooms = []
+        left = ROOM_BUDGET
+        for *_, d, cell in moves:
+            room = self.room(cell, need, left)
+            if room >= need:
+                return d
+            rooms.append((room, d))
+            left = max(left - room, 1)
+        # trapped: take the largest area
+        return max(rooms)[1]
+
+    def straight_distance(self, cell):
+        """Distance to the nearest good apple, ignoring everything in between."""
+        grid = self.engine.grid
+        x, y = grid.xy(cell)
+        best = gridlib.DistanceField.INF
+        for source in self.field.sources:
+            dx, dy = grid.xy(source)
+            dx, dy = abs(dx - x), abs(dy - y)
+            if grid.wrap:
+                dx, dy = min(dx, grid.w - dx), min(dy, grid.h - dy)
+            best = min(best, dx + dy)
+        return best
+
+    def room(self, start, limit, budget=None):
+        """Number of cells the head can reach after moving to start, counted up to limit,
+        or up to budget if it is smaller.
+        Snake cells are passable if the tail has left them by the time the head gets there,
+        even if the snake eats every good apple on the way, and then the snake can follow
+        its tail, so limit is returned.
+        """
+        cells = self.occ.cells
+        adj = self.field.adj
+        segs = self.engine.snake.segs
+        # body cell i is left after len(segs) - i steps, one more for every good apple eaten
+        growth = self.engine.good_apples
+        free_time = None
+        count = limit if budget is None else min(limit, budget)
+        seen = {start}
+        frontier = [start]
+        steps = 1
+        while frontier and len(seen) < count:
+            steps += 1
+            next_frontier = []
+            for cell in frontier:
+                for nb in adj[cell]:
+                    if nb in seen:
+                        continue
+                    if cells[nb] == SNAKE:
+                        if free_time is None:
+                            free_time = {c: len(segs) - i + growth for i, c in enumerate(segs)}
+                        if steps > free_time[nb]:
+                            return limit
+                        continue
+                    seen.add(nb)
+                    next_frontier.append(nb)
+            frontier = next_frontier
+        return len(seen)
+
+
+# cycles built or loaded in this process, by grid shape
+_cycles = {}
+
+
+def hamiltonian_cycle(grid, cache=None):
+    """gridlib.hamiltonian_cycle() memoized by grid shape, also in cache (assets.DiskCache) if given."""
+    shape = (grid.w, grid.h, grid.wrap)
+    if shape not in _cycles:
+        def build():
+            cycle = gridlib.hamiltonian_cycle(grid)
+            return struct.pack(f'<{len(cycle)}I', *cycle)
+        if cache is None:
+            data = build()
+        else:
+            data = cache.cached(cache.key('hamiltonian cycle', CYCLE_VERSION, *shape), build)
+        _cycles[shape] = list(struct.unpack(f'<{len(data) // 4}I', data))
+    return _cycles[shape]
+
+
+class CycleBot:
+    """Follows a Hamiltonian cycle of the grid, so it never runs into itself, and takes
+    shortcuts towards the next good apple and around bad apples when they are safe.
+
+    Cells are numbered by their position in the cycle. While the body lies along the cycle,
+    the cells from the head forward to the tail are free. A move forward by f cells
+    is safe if the body still lies along the cycle after it and leaves as many free cells
+    ahead as the snake can still grow on this level:
+    n - (f + fwd(new tail, head)) - 1 >= win_size - new size. That is one comparison per move.
+    Cells skipped stay free until the tail passes them, so when few cells are spare,
+    shortcuts only go around bad apples: eating them lap after lap would shrink the snake.
+    A snake of one or two cells goes around bad apples to the cells before the next good apple
+    in the cycle. A snake that does not lie along the cycle, e.g. after a restored state,
+    follows the cycle until it does.
+    """
+    def __init__(self, eng, cache=None):
+        self.engine = eng
+        grid = eng.grid
+        self.cycle = cycle = hamiltonian_cycle(grid, cache)
+        self.n = len(cycle)
+        # position of every cell in the cycle
+        self.order = order = [-1] * (grid.w * grid.h)
+        for i, cell in enumerate(cycle):
+            order[cell] = i
+        # cell left out of the cycle takes the position of the cycle cell it can replace
+        adj = [{grid.neighbors[d][cell] for d in 'nesw'} for cell in range(len(order))]
+        for cell, i in enumerate(order):
+            if i < 0:
+                for nb in adj[cell]:
+                    if nb >= 0 and cycle[(order[nb] + 2) % self.n] in adj[cell]:
+                        order[cell] = (order[nb] + 1) % self.n
+                        break
+        self.occ = None
+        self.good_tags = set()
+        self.aligned = False
+
+    def _aligned(self):
+        """Test if body cells from the head back to the tail go backward along the cycle,
+        leaving room ahead of the head for the rest of growth on this level.
+        """
+        order, n = self.order, self.n
+        segs = self.engine.snake.segs
+        span = 0
+        prev = order[segs[0]]
+        for i in range(1, len(segs)):
+            pos = order[segs[i]]
+            step = (prev - pos) % n
+            if step == 0:
+                return False
+            span += step
+            prev = pos
+        return n - span - 1 >= self.engine.win_size - len(segs)
+
+    def _approach(self):
+        """First step of the shortest path for a snake of one or two cells to the cells before
+        a good apple in the cycle, around apples, so that it follows the cycle when it grows.
+        It can not run into itself, but bad apples on the cycle could eat it whole.
+        The path comes to the first of those cells from outside, so that the body lies along
+        them. If apples take all those cells, the path goes to a good apple itself.
+        Returns None if there is no path or the head is on the way already.
+        """
+        eng = self.engine
+        grid, occ, order = eng.grid, self.occ, self.order
+        head = eng.snake.segs[0]
+        good = [a.cell for a in eng.apples if a.good and a.cell is not None]
+        goals = set()
+        # path comes to the first cell of a way from outside of it, so that the body lies along it
+        avoid = set()
+        for apple in good:
+            way = [self.cycle[order[apple] - i] for i in range(1, len(eng.snake) + 1)]
+            if head in way:
+                return None
+            # a snake of two cells can eat one bad apple on the way
+            bad = sum(occ[cell] >= APPLE and occ[cell] not in self.good_tags for cell in way)
+            free = sum(occ[cell] == engine.EMPTY for cell in way)
+            if free == len(way) or free + bad == 2 and bad == 1:
+                goals.add(way[-1])
+                avoid.update(way[:-1])
+        if not goals:
+            goals = set(good)
+            avoid.clear()
+        if not goals or head in goals:
+            return None
+        return self._first_step(goals, avoid)
+
+    def _first_step(self, goals, avoid):
+        """First step of the shortest path from the head to one of goals, through empty cells
+        not in avoid. None if there is no path.
+        """
+        eng = self.engine
+        grid, occ = eng.grid, self.occ
+        head = eng.snake.segs[0]
+        first = {}
+        frontier = []
+        for d in 'nesw':
+            cell = grid.neighbors[d][head]
+            if (d != eng.snake.backward and cell >= 0 and cell not in avoid
+                    and (occ[cell] == engine.EMPTY or cell in goals)):
+                first[cell] = d
+                frontier.append(cell)
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                if cell in goals:
+                    return first[cell]
+                for d in 'nesw':
+                    nb = grid.neighbors[d][cell]
+                    if (nb >= 0 and nb not in first and nb not in avoid
+                            and (occ[nb] == engine.EMPTY or nb in goals)):
+                        first[nb] = first[cell]
+                        next_frontier.append(nb)
+            frontier = next_frontier
+        return None
+
+    def _unwinds(self, cell, new_size):
+        """Test if the snake, after moving its head to cell and changing size to new_size,
+        can follow the cycle from there until its body lies along it: every body cell is left
+        before the head comes to it, even if the snake eats every good apple on the way.
+        """
+        order, n = self.order, self.n
+        segs = self.engine.snake.segs
+        start = order[cell]
+        # body cell j leaves after new_size - j moves, one more for every good apple eaten
+        slack = new_size + self.engine.good_apples
+        for j in range(1, new_size):
+            if (order[segs[j - 1]] - start) % n <= slack - j:
+                return False
+        return True
+
+    def _room(self, start):
+        """Number of cells reachable from start through empty cells, counted up to SMALL_ROOM,
+        and SMALL_ROOM if a good apple can be reached.
+        """
+        grid, occ = self.engine.grid, self.occ
+        seen = {start}
+        frontier = [start]
+        while frontier and len(seen) < SMALL_ROOM:
+            next_frontier = []
+            for cell in frontier:
+                for d in 'nesw':
+                    nb = grid.neighbors[d][cell]
+                    if nb < 0 or nb in seen:
+                        continue
+                    if occ[nb] in self.good_tags:
+                        return SMALL_ROOM
+                    if occ[nb] == engine.EMPTY:
+                        seen.add(nb)
+                        next_frontier.append(nb)
+            frontier = next_frontier
+        return min(len(seen), SMALL_ROOM)
+
+    def act(self):
+        eng = self.engine
+        if eng.occ is not self.occ:
+            # new level or restored state
+            self.occ = eng.occ
+            self.good_tags = {a.tag for a in eng.apples if a.good}
+            self.aligned = False
+        if not self.aligned:
+            # after a move off the cycle or a new start
+            self.aligned = self._aligned()
+        occ, order, n = self.occ, self.order, self.n
+        snake = eng.snake
+        size = len(snake)
+        segs = snake.segs
+        head = order[segs[0]]
+        target = None
+        for apple in eng.apples:
+            if apple.good and apple.cell is not None:
+                # 1 to n, apple in the cell left out of the cycle can share position with the head
+                ahead = (order[apple.cell] - head - 1) % n + 1
+                if target is None or ahead < target[0]:
+                    target = ahead, apple.cell
+        approach = self._approach() if size <= 2 else None
+        # positions ahead of the nearest bad apple, 1 to n, a move forward by more skips it
+        bad_ahead = min(((order[a.cell] - head - 1) % n + 1 for a in eng.apples
+                         if not a.good and a.cell is not None), default=n)
+        best = None
+        for d in 'nesw':
+            cell = eng.grid.neighbors[d][segs[0]]
+            if d == snake.backward or cell < 0 or occ[cell] == SNAKE:
+                continue
+            f = (order[cell] - head) % n
+            good = occ[cell] in self.good_tags
+            bad = occ[cell] >= APPLE and not good
+            new_size = max(size + good - bad, 1)
+            span = 0
+            if new_size > 1:
+                # cycle positions from the tail after the move to the new head
+                tail = segs[-1] if good else segs[-3] if bad else segs[-2]
+                span = f + (head - order[tail]) % n
+            # free cells ahead beyond those the snake still grows into on this level
+            spare = n - span - 1 - (eng.win_size - new_size)
+            along = self.aligned and f > 0 and spare >= 0
+            # a snake of one or two cells can not run into itself
+            safe = along or new_size <= 2
+            if not safe and good and size <= 2:
+                # the good apple is next to the head but not in line with the body
+                safe = self._unwinds(cell, new_size)
+            remaining = n if target is None else (target[0] - f) % n
+            # unsafe moves only if there is nothing else, e.g. a new snake across the cycle,
+            # and a bad apple that would eat the last cell, or one cell going into a dead end,
+            # only if there is no other move at all
+            deadly = (bad and size == 1) or (new_size == 1 and self._room(cell) < SMALL_ROOM)
+            # bad apples are avoided, unless that means going past the target
+            past = target is not None and (f, cell != target[1]) > (target[0], False)
+            # shortcut that spends scarce spare cells and does not go around a bad apple
+            wasteful = f > 1 and bad_ahead >= f and spare < SPARE_CELLS
+            key = (deadly, not safe, not safe and f != 1, d != approach, past, bad, wasteful, remaining,
+                   target is None or cell != target[1], f != 1)
+            if best is None or key < best[0]:
+                best = key, d, along
+        if best is None:
+            return None
+        _, d, self.aligned = best
+        return d
+
+
+class _Node:
+    """Node of MCTSBot search tree, children by direction."""
+    __slots__ = ('visits', 'value', 'children')
+
+    def __init__(self):
+        self.visits = 0
+        self.value = 0.0
+        self.children = {}
+
+
+class MCTSBot:
+    """Monte Carlo tree search over the next moves, a reference bot for search
+    with cloned states (engine.Engine.clone()).
+
+    The tree is open loop: a node is a sequence of moves from the current state. Every playout
+    restores the current state into a search engine of the bot and plays moves down the tree,
+    chosen by UCB1, then moves of a simple policy for up to depth more steps: to the nearest
+    good apple, or at random, but not into a wall or the body. New moves are added to the tree
+    in the order of that policy, moves into a wall or the body are never added.
+    Apples eaten in a playout respawn in random cells, different every time, like in a game
+    whose future is not known. Playout value is 0 for a death, 1 for level_up or win,
+    otherwise apples eaten, good minus bad discounted by steps, mapped to (0, 1),
+    with the part of the way to the nearest good apple counted as part of an apple.
+    The first move of the best mean value is taken.
+
+    With workers > 1, playouts are split between that many processes, each searching a tree
+    of its own from the same state, and values of first moves are added up.
+    Call close() to stop the worker processes.
+    """
+    def __init__(self, eng, cache=None, playouts=PLAYOUTS, depth=PLAYOUT_DEPTH, workers=0, seed=None):
+        self.engine = eng
+        self.playouts = playouts
+        self.depth = depth
+        self.rng = random.Random(seed)
+        self.sim = engine.Engine(eng.grid, eng.start_size, eng.win_size, eng.win_level,
+                                 eng.good_apples, eng.bad_apples, seed=self.rng.getrandbits(64))
+        self.neighbors = eng.grid.neighbors
+        self.good_tags = {APPLE + i for i in range(eng.good_apples)}
+        self.workers = workers
+        self.pool = None
+        if workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(workers)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def act(self):
+        state = self.engine.clone()
+        if self.pool is None:
+            totals = self.search(state, self.playouts)
+        else:
+            eng = self.engine
+            settings = (eng.grid.w, eng.grid.h, eng.grid.wrap, eng.start_size, eng.win_size,
+                        eng.win_level, eng.good_apples, eng.bad_apples, self.depth)
+            playouts = -(-self.playouts // self.workers)
+            futures = [self.pool.submit(_search, settings, state, playouts, self.rng.getrandbits(64))
+                       for _ in range(self.workers)]
+            totals = {}
+            for future in futures:
+                for d, (visits, value) in future.result().items():
+                    total = totals.get(d, (0, 0.0))
+                    totals[d] = total[0] + visits, total[1] + value
+        if not totals:
+            return None
+        return max(totals, key=lambda d: totals[d][1] / totals[d][0])
+
+    def search(self, state, playouts):
+        """Search tree from state with given number of playouts,
+        return (visits, sum of values) of first moves.
+        """
+        root = _Node()
+        for _ in range(playouts):
+            self._playout(state, root)
+        return {d: (child.visits, child.value) for d, child in root.children.items()}
+
+    def _ranked_moves(self):
+        """Directions of the search engine snake without the backward one, best first:
+        not into a wall or body, not into a bad apple, nearest to a good apple.
+        Returns list of (blocked, direction).
+        """
+        sim = self.sim
+        occ, snake = sim.occ, sim.snake
+        head = snake.segs[0]
+        moves = []
+        for d in 'nesw':
+            if d == snake.backward:
+                continue
+            cell = self.neighbors[d][head]
+            if cell < 0 or occ[cell] == SNAKE:
+                moves.append((True, True, 0, d))
+            else:
+                moves.append((False, occ[cell] >= APPLE and occ[cell] not in self.good_tags,
+                              self._apple_distance(cell), d))
+        moves.sort()
+        return [(move[0], move[3]) for move in moves]
+
+    def _playout_move(self):
+        """Direction for a playout step out of the tree: to a cell that is not a wall or body,
+        the best of _ranked_moves(), or at random with probability RANDOM_MOVES.
+        """
+        moves = self._ranked_moves()
+        if self.rng.random() < RANDOM_MOVES:
+            open_moves = [d for blocked, d in moves if not blocked]
+            if open_moves:
+                return self.rng.choice(open_moves)
+        return moves[0][1]
+
+    def _apple_distance(self, cell):
+        """Steps from cell to the nearest good apple in the search engine, not going
+        around anything, or the grid size if there is none.
+        """
+        sim = self.sim
+        grid = sim.grid
+        x, y = grid.xy(cell)
+        best = grid.w + grid.h
+        for apple in sim.apples[:sim.good_apples]:
+            if apple.cell is not None:
+                ax, ay = grid.xy(apple.cell)
+                dx, dy = abs(ax - x), abs(ay - y)
+                if grid.wrap:
+                    dx, dy = min(dx, grid.w - dx), min(dy, grid.h - dy)
+                best = min(best, dx + dy)
+        return best
+
+    def _playout(self, state, root):
+        sim = self.sim
+        sim.restore(state)
+        node = root
+        path = [root]
+        gain = 0.0
+        weight = 1.0
+        value = None
+        steps = 0
+        leaf = False
+        while value is None and steps < self.depth:
+            if leaf:
+                action = self._playout_move()
+                steps += 1
+            else:
+                moves = [d for blocked, d in self._ranked_moves() if not blocked and d not in node.children]
+                if moves:
+                    action = moves[0]
+                    node.children[action] = _Node()
+                    leaf = True
+                elif node.children:
+                    log_visits = math.log(node.visits)
+                    action = max(node.children, key=lambda d: _ucb(node.children[d], log_visits))
+                else:
+                    # every move runs into a wall or the body
+                    value = 0.0
+                    break
+                node = node.children[action]
+                path.append(node)
+            result = sim.step(action)
+            if result in ('self', 'wall', 'size_zero'):
+                value = 0.0
+            elif result in ('level_up', 'win'):
+                value = 1.0
+            elif result == 'good':
+                gain += weight
+            elif result == 'bad':
+                gain -= weight
+            weight *= DISCOUNT
+        if value is None:
+            # part of the way to the nearest good apple counts as part of an apple
+            grid = sim.grid
+            gain += weight * (1 - self._apple_distance(sim.snake.segs[0]) / (grid.w + grid.h))
+            value = 1 / (1 + math.exp(-gain))
+        for node in path:
+            node.visits += 1
+            node.value += value
+
+
+def _ucb(node, log_parent_visits):
+    return node.value / node.visits + EXPLORATION * math.sqrt(log_parent_visits / node.visits)
+
+
+# MCTSBot of a worker process, by settings
+_search_bots = {}
+
+
+def _search(settings, state, playouts, seed):
+    """MCTSBot.search() in a worker process."""
+    if settings not in _search_bots:
+        w, h, wrap, start_size, win_size, win_level, good_apples, bad_apples, depth = settings
+        eng = engine.Engine(gridlib.Grid(w, h, wrap), start_size, win_size, win_level,
+                            good_apples, bad_apples)
+        _search_bots[settings] = MCTSBot(eng, depth=depth)
+    bot = _search_bots[settings]
+    bot.rng.seed(seed)
+    bot.sim.rng.seed(seed + 1)
+    return bot.search(state, playouts)
+
+
+def play(eng, bot, max_steps=100000):
+    """Play engine game with bot until it is won, lost or max_steps is reached.
+    Return (result of last step, number of steps).
+    """
+    result = None
+    for step in range(max_steps):
+        result = eng.step(bot.act())
+        if result == 'level_up':
+            eng.level_up()
+        elif result in ('win', 'self', 'wall', 'size_zero'):
+            return result, step + 1
+    return result, max_steps
+
+
+def test_PathBot():
+    for wrap in (False, True):
+        grid = gridlib.Grid(15, 15, wrap)
+        eng = engine.Engine(grid, 3, 10, 3, 1, 5, seed=0)
+        bot = PathBot(eng)
+        result, steps = play(eng, bot)
+        assert result == 'win', (wrap, result, eng.stats.level)
+        # field kept up to date step by step matches one built from scratch
+        full = gridlib.DistanceField(grid)
+        full.sources, full.blocked = bot.field.sources, bot.field.blocked
+        full.reset()
+        full.update()
+        bot.field.update()
+        assert full.dist == bot.field.dist
+    # seeds that once ran into their own body, grown by apples eaten on the way
+    grid = gridlib.Grid(30, 30, False)
+    for seed in (7, 14, 34):
+        eng = engine.Engine(grid, 3, 100, 1, 1, 5, seed=seed)
+        result, steps = play(eng, PathBot(eng))
+        assert result == 'win', (seed, result, len(eng.snake))
+
+
+def test_CycleBot(tmp_path):
+    import assets
+    cache = assets.DiskCache(tmp_path)
+    for w, h, wrap in ((8, 6, False), (7, 7, False), (5, 6, False), (6, 6, True), (5, 8, True), (7, 5, True)):
+        grid = gridlib.Grid(w, h, wrap)
+        n = w * h - (not wrap and w * h % 2)
+        # long enough snake for the body to cover most of the grid
+        eng = engine.Engine(grid, 3, n - 4, 3, 2, 3, seed=w)
+        result, steps = play(eng, CycleBot(eng, cache))
+        assert result == 'win', (w, h, wrap, result, eng.stats.level, len(eng.snake))
+    _cycles.clear()
+    assert hamiltonian_cycle(grid, cache) == gridlib.hamiltonian_cycle(grid)
+    # nearly full grid with more bad than good apples, once shrank on every lap
+    grid = gridlib.Grid(10, 10, False)
+    for seed in range(5):
+        eng = engine.Engine(grid, 3, 95, 1, 1, 2, seed=seed)
+        result, steps = play(eng, CycleBot(eng, cache), max_steps=20000)
+        assert result == 'win', (seed, result, len(eng.snake))
+    # game constants of rules.py, seed 162 once went around the good apple forever
+    import rules
+    grid = gridlib.Grid(rules.GRID_W, rules.GRID_H, rules.WRAP_AROUND_BOUNDS)
+    for seed in list(range(100)) + [162]:
+        eng = engine.Engine(grid, rules.START_SIZE, rules.WIN_SIZE, rules.WIN_LEVEL,
+                            rules.GOOD_APPLES, rules.BAD_APPLES, seed=seed)
+        result, steps = play(eng, CycleBot(eng, cache), max_steps=10000)
+        assert result == 'win', (seed, result, eng.stats.level, len(eng.snake))
+
+
+def test_MCTSBot():
+    grid = gridlib.Grid(8, 6)
+    eng = engine.Engine(grid, 3, 10, 2, 1, 3, seed=0)
+    result, steps = play(eng, MCTSBot(eng, playouts=50, seed=0))
+    assert result == 'win', (result, eng.stats.level, len(eng.snake))
+    # playouts split between worker processes
+    eng.new_game(1)
+    bot = MCTSBot(eng, playouts=50, workers=2, seed=1)
+    try:
+        for _ in range(20):
+            assert eng.step(bot.act()) in ('move', 'good', 'bad')
+    finally:
+        bot.close()
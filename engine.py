@@ -0,0 +1,379 @@
+"""
+Snake game rules without display or clock.
+
+The engine is advanced explicitly with Engine.step(), so it can run as fast
+as Python allows (bots, evaluation), or be driven by a frame loop (snake.py).
+"""
+
+import random
+from collections import deque
+
+import gridlib
+
+
+# occupancy values, apple number i is stored as APPLE + i
+EMPTY, SNAKE, APPLE = gridlib.Occupancy.EMPTY, 1, 2
+# where snake starts every level
+START_LOC, START_FACING = (0, 0), 'n'
+
+
+class Apple:
+    """Apple that the snake eats to grow (good) or shrink (bad)."""
+    def __init__(self, grid, occ, good, tag):
+        self.grid = grid
+        self.occ = occ
+        self.good = good
+        self.tag = tag
+        self.cell = None
+        self.move()
+
+    def move(self):
+        """Move apple to random empty cell, do not move on snake or other apples.
+        If the board is full, apple is taken off the board (cell is None) and False is returned.
+        """
+        if self.cell is not None and self.occ[self.cell] == self.tag:
+            self.occ[self.cell] = EMPTY
+        self.cell = self.occ.random_free()
+        if self.cell is None:
+            return False
+        self.occ[self.cell] = self.tag
+        return True
+
+
+class Snake:
+    """Snake body as a deque of cell ids, head first.
+    Moving adds a cell at the head end and removes from the tail end, in O(1).
+    """
+    def __init__(self, grid, occ, head_loc, facing, size):
+        self.neighbors = grid.neighbors
+        self.occ = occ
+        self.facing = facing
+        self.backward = gridlib.opposite_dir(facing)
+        cell = grid.cell(*head_loc)
+        self.segs = deque([cell])
+        for _ in range(1, size):
+            cell = grid.step(cell, self.backward)
+            self.segs.append(cell)
+        for cell in self.segs:
+            occ[cell] = SNAKE
+
+    def __len__(self):
+        return len(self.segs)
+
+    def turn(self, facing):
+        """Change facing direction. Can not turn backward."""
+        if facing != self.backward:
+            self.facing = facing
+
+    def move(self, apples):
+        """
+        Move in the facing direction and return result. Grow if got apple.
+        Returns: 'move', Apple instance that was hit, 'self', 'wall' or 'size_zero'.
+        """
+        cell = self.neighbors[self.facing][self.segs[0]]
+
+        if cell < 0:
+            return 'wall'
+
+        tag = self.occ[cell]
+        if tag >= APPLE:
+            hit_apple = apples[tag - APPLE]
+            result = hit_apple
+            if hit_apple.good:
+                self._push_head(cell)
+            else:
+                if len(self) == 1:
+                    return 'size_zero'
+                # head moves forward, two last segments are removed
+                self._push_head(cell)
+                self._pop_tail()
+                self._pop_tail()
+        elif tag == SNAKE:
+            result = 'self'
+        else:
+            result = 'move'
+            self._push_head(cell)
+            self._pop_tail()
+
+        self.backward = gridlib.opposite_dir(self.facing)
+        return result
+
+    def _push_head(self, cell):
+        self.segs.appendleft(cell)
+        self.occ[cell] = SNAKE
+
+    def _pop_tail(self):
+        self.occ[self.segs.pop()] = EMPTY
+
+    def collide(self, cell):
+        """Test if cell collides with any segment."""
+        return self.occ[cell] == SNAKE
+
+
+class Stats:
+    """Game stats: size, score, level."""
+    def __init__(self, start_size):
+        self.start_size = start_size
+        self.size = start_size
+        self.score = 0
+        self.level = 1
+
+    def level_up(self):
+        self.level += 1
+        self.size = self.start_size
+
+    def size_up(self):
+        self.size += 1
+        self.score += self.level
+
+    def size_down(self):
+        if self.size == 1:
+            return
+        self.size -= 1
+
+
+class State:
+    """Game state in flat copies of engine data, made by Engine.clone() for Engine.restore().
+    Holds no objects of the engine, so it is cheap to make, to keep and to pickle,
+    and one state can be restored any number of times.
+    """
+    __slots__ = ('level', 'size', 'score', 'facing', 'backward', 'segs',
+                 'cells', 'free', 'free_pos', 'apple_cells', 'waiting')
+
+
+class Engine:
+    """Complete game: snake, apples and stats, advanced one step at a time.
+
+    Engine.step() returns one of:
+    'move' - moved to an empty cell,
+    'good', 'bad' - ate a good or a bad apple,
+    'level_up' - ate a good apple and reached win_size,
+    'win' - same as 'level_up' on the last level,
+    'self', 'wall', 'size_zero' - snake died, level is lost.
+    After 'level_up', call level_up() to start next level.
+    profiler can be set to profiler.FrameProfiler to time phases of step(),
+    and recorder to replay.Recorder to record the game.
+
+    All randomness comes from rng, seeded with seed at the start of every game,
+    so a game is reproduced by the same seed and the same actions.
+    """
+    def __init__(self, grid, start_size, win_size, win_level, good_apples, bad_apples, seed=None):
+        self.grid = grid
+        self.start_size = start_size
+        self.win_size = win_size
+        self.win_level = win_level
+        self.good_apples = good_apples
+        self.bad_apples = bad_apples
+        self.profiler = None
+        self.recorder = None
+        self.new_game(seed)
+
+    def new_game(self, seed=None):
+        """Start new game, with random seed if not given."""
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.stats = Stats(self.start_size)
+        self.new_level()
+
+    def new_level(self):
+        self.occ = gridlib.Occupancy(self.grid, self.rng)
+        self.snake = Snake(self.grid, self.occ, START_LOC, START_FACING, self.stats.size)
+        self.apples = []
+        for i in range(self.good_apples + self.bad_apples):
+            good = i < self.good_apples
+            self.apples.append(Apple(self.grid, self.occ, good, APPLE + i))
+        # apples that did not fit on a full board, placed again when cells are freed
+        self.waiting = [a for a in self.apples if a.cell is None]
+
+    def level_up(self):
+        self.stats.level_up()
+        self.new_level()
+
+    def get_state(self):
+        """Complete game state as a tuple of numbers, strings and tuples:
+        stats, snake body and facing, apple cells, waiting apples, order of free cells and rng state.
+        """
+        snake = self.snake
+        return (self.stats.level, self.stats.size, self.stats.score,
+                snake.facing, snake.backward, tuple(snake.segs),
+                tuple(a.cell for a in self.apples),
+                tuple(self.apples.index(a) for a in self.waiting),
+                tuple(self.occ.free), self.rng.getstate())
+
+    def set_state(self, state):
+        """Restore state from get_state() of an engine with the same grid and settings.
+        Snake and apple objects are kept and updated.
+        """
+        level, size, score, facing, backward, segs, apple_cells, waiting, free, rng_state = state
+        self.stats.level, self.stats.size, self.stats.score = level, size, score
+        self.rng.setstate(rng_state)
+        occ = self.occ = gridlib.Occupancy(self.grid, self.rng)
+        snake = self.snake
+        snake.occ = occ
+        snake.facing, snake.backward = facing, backward
+        snake.segs = deque(segs)
+        for cell in segs:
+            occ[cell] = SNAKE
+        for apple, cell in zip(self.apples, apple_cells):
+            apple.occ = occ
+            apple.cell = cell
+            if cell is not None:
+                occ[cell] = apple.tag
+        self.waiting = [self.apples[i] for i in waiting]
+        # random cells are drawn by position in the free list, so its order matters
+        occ.free = list(free)
+        for i, cell in enumerate(free):
+            occ.free_pos[cell] = i
+        occ.changed.clear()
+
+    def clone(self):
+        """Current state as State, for search bots that try many moves from it.
+        Faster than get_state(), since the random generator is left out:
+        a restored game draws other apple cells than the game it was cloned from,
+        unless the generator state is restored too.
+        """
+        occ, snake = self.occ, self.snake
+        state = State()
+        state.level, state.size, state.score = self.stats.level, self.stats.size, self.stats.score
+        state.facing, state.backward = snake.facing, snake.backward
+        state.segs = tuple(snake.segs)
+        state.cells = bytes(occ.cells)
+        state.free = occ.free[:]
+        state.free_pos = occ.free_pos[:]
+        state.apple_cells = tuple([a.cell for a in self.apples])
+        state.waiting = tuple([a.tag - APPLE for a in self.waiting]) if self.waiting else ()
+        return state
+
+    def restore(self, state):
+        """Restore State from clone() of an engine with the same grid and settings.
+        Occupancy, snake and apple objects are kept and updated, the random generator goes on.
+        """
+        stats, occ, snake = self.stats, self.occ, self.snake
+        stats.level, stats.size, stats.score = state.level, state.size, state.score
+        snake.facing, snake.backward = state.facing, state.backward
+        snake.segs = deque(state.segs)
+        occ.cells[:] = state.cells
+        occ.free = state.free[:]
+        occ.free_pos = state.free_pos[:]
+        occ.changed.clear()
+        apples = self.apples
+        for apple, cell in zip(apples, state.apple_cells):
+            apple.cell = cell
+        self.waiting = [apples[i] for i in state.waiting] if state.waiting else []
+
+    def step(self, action=None):
+        """Turn snake to action direction (if given), move it and return result.
+        Cells changed by the step are listed in occ.changed.
+        """
+        prof = self.profiler
+        self.occ.changed.clear()
+        if action is not None:
+            self.snake.turn(action)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if prof:
+            prof.begin('snake move')
+        result = self.snake.move(self.apples)
+        if prof:
+            prof.end()
+        if self.waiting:
+            self.waiting = [a for a in self.waiting if not a.move()]
+        if not isinstance(result, Apple):
+            return result
+
+        apple = result
+        if prof:
+            prof.begin('apple respawn')
+        if not apple.move():
+            self.waiting.append(apple)
+        if prof:
+            prof.end()
+        if not apple.good:
+            self.stats.size_down()
+            return 'bad'
+        self.stats.size_up()
+        if len(self.snake) == self.win_size:
+            return 'win' if self.stats.level == self.win_level else 'level_up'
+        return 'good'
+
+
+def test_engine():
+    grid = gridlib.Grid(15, 15)
+    engine = Engine(grid, 3, 10, 10, 1, 5)
+    assert list(engine.snake.segs) == [grid.cell(0, 0), grid.cell(0, 1), grid.cell(0, 2)]
+    assert engine.step() == 'wall'
+
+    engine.new_game()
+    put_apple(engine, 0, 1, 0)
+    for i in range(1, 6):
+        put_apple(engine, i, 14 - i, 14)
+    assert engine.step('e') == 'good'
+    assert len(engine.snake) == engine.stats.size == 4
+    assert engine.stats.score == 1
+    put_apple(engine, 0, 14, 14)
+    assert engine.step('s') == 'move'
+    assert engine.occ.changed == [grid.cell(1, 1), grid.cell(0, 2)]
+    # tail has not moved away yet
+    assert engine.step('w') == 'self'
+    assert engine.occ.count(SNAKE) == len(engine.snake)
+
+    # 2x3 board: snake and 2 apples fill it, eaten apple waits for a free cell
+    grid = gridlib.Grid(2, 3)
+    engine = Engine(grid, 3, 10, 10, 1, 2)
+    assert not engine.waiting
+    put_apple(engine, 0, 1, 0)
+    put_apple(engine, 1, 1, 1)
+    put_apple(engine, 2, 1, 2)
+    assert engine.step('e') == 'good'
+    assert engine.waiting == [engine.apples[0]] and engine.apples[0].cell is None
+    assert engine.step('s') == 'bad'
+    assert not engine.waiting
+
+    # game continues the same from restored state
+    grid = gridlib.Grid(8, 8)
+    a = Engine(grid, 3, 10, 10, 2, 3, seed=1)
+    b = Engine(grid, 3, 10, 10, 2, 3, seed=2)
+    def safe_action(engine, i):
+        head = engine.snake.segs[0]
+        for d in 'nesw'[i % 4:] + 'nesw'[:i % 4]:
+            cell = grid.neighbors[d][head]
+            if d != engine.snake.backward and cell >= 0 and engine.occ[cell] != SNAKE:
+                return d
+    for i in range(30):
+        assert a.step(safe_action(a, i)) in ('move', 'good', 'bad')
+    b.set_state(a.get_state())
+    for i in range(30):
+        action = safe_action(a, i * 7)
+        assert a.step(action) == b.step(action)
+        assert a.get_state() == b.get_state()
+
+
+def test_clone():
+    grid = gridlib.Grid(8, 8)
+    a = Engine(grid, 3, 30, 10, 2, 3, seed=1)
+    b = Engine(grid, 3, 30, 10, 2, 3, seed=2)
+    state, rng_state = a.clone(), a.rng.getstate()
+    before = a.get_state()
+    results = [a.step(d) for d in 'eeeesswwww']
+    after = a.get_state()
+    # restored twice from the same state, on the same and on another engine
+    for eng in (a, b):
+        eng.restore(state)
+        eng.rng.setstate(rng_state)
+        assert eng.get_state() == before
+        assert [eng.step(d) for d in 'eeeesswwww'] == results
+        assert eng.get_state() == after
+        assert eng.occ.count(SNAKE) == len(eng.snake)
+    # state is kept through pickling
+    import pickle
+    b.restore(pickle.loads(pickle.dumps(state)))
+    b.rng.setstate(rng_state)
+    assert b.get_state() == before
+
+def put_apple(engine, i, x, y):
+    """Move apple number i to (x, y), for tests."""
+    apple = engine.apples[i]
+    if apple.cell is not None and engine.occ[apple.cell] == apple.tag:
+        engine.occ[apple.cell] = EMPTY
+    apple.cell = engine.grid.cell(x, y)
+    engine.occ[apple.cell] = apple.tag
@@ -2,12 +2,17 @@
 Working with grid-like maps.
 """
 
-from random import randrange
+import heapq
+import random
+from collections import deque
+
+# (dx, dy) step in every direction
+DIRECTIONS = dict(n=(0, -1), e=(1, 0), s=(0, 1), w=(-1, 0))
+OPPOSITES = dict(n='s', e='w', s='n', w='e')
 
 def opposite_dir(d):
     """Return opposite direction."""
-    opposites = dict(n='s', e='w', s='n', w='e')
-    return opposites[d]
+    return OPPOSITES[d]
 
 def is_opposite_dir(a, b):
     """
@@ -22,24 +27,325 @@ def is_opposite_dir(a, b):
 
 
 class Grid:
+    """Grid of w x h cells.
+    Cells can be referred to by Location objects or by integer cell ids (y * w + x).
+    For every direction, neighbors[dir][cell] is the cell id one step away,
+    -1 if that step hits a wall.
+    """
     def __init__(self, w, h, wrap_around=False):
         self.w = w
         self.h = h
         self.wrap = wrap_around
+        self.neighbors = {d: self._neighbor_list(dx, dy) for d, (dx, dy) in DIRECTIONS.items()}
+
+    def _neighbor_list(self, dx, dy):
+        cells = []
+        for y in range(self.h):
+            for x in range(self.w):
+                nx = x + dx
+                ny = y + dy
+                if self.wrap:
+                    cells.append(self.cell(nx % self.w, ny % self.h))
+                elif self.out_of_bounds(nx, ny):
+                    cells.append(-1)
+                else:
+                    cells.append(self.cell(nx, ny))
+        return cells
 
     def loc(self, x, y):
         return Location(self, x, y)
 
-    def random_loc(self):
-        x = randrange(0, self.w)
-        y = randrange(0, self.h)
+    def cell(self, x, y):
+        """Integer id of (x, y) cell, from 0 to w * h - 1."""
+        return y * self.w + x
+
+    def xy(self, cell):
+        """(x, y) coordinates of integer cell id."""
+        y, x = divmod(cell, self.w)
+        return x, y
+
+    def cell_loc(self, cell):
+        """Location of integer cell id."""
+        y, x = divmod(cell, self.w)
+        return Location(self, x, y)
+
+    def step(self, cell, dir_):
+        """Cell id one step from cell in direction dir_, -1 if hit the wall."""
+        return self.neighbors[dir_][cell]
+
+    def random_loc(self, rng=random):
+        """Random location, drawn with rng (random.Random instance or random module)."""
+        x = rng.randrange(0, self.w)
+        y = rng.randrange(0, self.h)
         return Location(self, x, y)
 
     def out_of_bounds(self, x, y):
         return x < 0 or x >= self.w or y < 0 or y >= self.h
 
 
+class Occupancy:
+    """What occupies every cell of a grid, as a small integer per cell id.
+    Zero means empty, meaning of other values is up to the user.
+    Empty cells are also kept in a swap-remove list with position map,
+    so that a random empty cell can be drawn in O(1).
+    Cells whose value changed are appended to the changed list, users clear it.
+    Random cells are drawn with rng (random.Random instance or random module).
+    """
+    EMPTY = 0
+
+    def __init__(self, grid, rng=random):
+        self.grid = grid
+        self.rng = rng
+        size = grid.w * grid.h
+        self.cells = bytearray(size)
+        # empty cells in arbitrary order, and index of every cell in that list (-1 if not empty)
+        self.free = list(range(size))
+        self.free_pos = list(range(size))
+        self.changed = []
+
+    def __getitem__(self, cell):
+        return self.cells[cell]
+
+    def __setitem__(self, cell, value):
+        old = self.cells[cell]
+        if old == value:
+            return
+        self.cells[cell] = value
+        self.changed.append(cell)
+        if old == self.EMPTY and value != self.EMPTY:
+            i = self.free_pos[cell]
+            last = self.free.pop()
+            if last != cell:
+                self.free[i] = last
+                self.free_pos[last] = i
+            self.free_pos[cell] = -1
+        elif old != self.EMPTY and value == self.EMPTY:
+            self.free_pos[cell] = len(self.free)
+            self.free.append(cell)
+
+    def count(self, value):
+        """Number of cells holding value."""
+        if value == self.EMPTY:
+            return len(self.free)
+        return self.cells.count(value)
+
+    def full(self):
+        return not self.free
+
+    def random_free(self):
+        """Random empty cell, or None if the grid is full."""
+        if not self.free:
+            return None
+        return self.free[self.rng.randrange(len(self.free))]
+
+
+class DistanceField:
+    """Distance in steps from every cell to the nearest source cell, going around blocked cells.
+    Unreachable and blocked cells have distance INF.
+    Sources and blocked cells are changed one at a time. Distances that go up are fixed
+    right away, visiting only cells whose every shortest path is cut. Distances that go
+    down are passed on to neighbors by update(), which can be given a budget of cells
+    to spread the work of a big change (new source) over several calls.
+    If more than raise_limit distances would go up at once, all distances are reset
+    and found again by update() calls instead.
+    """
+    INF = 1 << 30
+
+    def __init__(self, grid):
+        self.grid = grid
+        size = grid.w * grid.h
+        nbs = [grid.neighbors[d] for d in DIRECTIONS]
+        # cells one step away from every cell, walls left out
+        self.adj = [tuple(n[cell] for n in nbs if n[cell] >= 0) for cell in range(size)]
+        self.dist = [self.INF] * size
+        self.blocked = bytearray(size)
+        self.sources = set()
+        # cells whose decreased distance is not passed on to neighbors yet
+        self.pending = deque()
+        self.raise_limit = None
+
+    def reset(self):
+        """Drop all distances and start again from the sources, distances are found by update()."""
+        self.dist = [self.INF] * len(self.dist)
+        self.pending = deque()
+        for cell in self.sources:
+            if not self.blocked[cell]:
+                self.dist[cell] = 0
+                self.pending.append(cell)
+
+    def add_source(self, cell):
+        if cell in self.sources:
+            return
+        self.sources.add(cell)
+        if not self.blocked[cell]:
+            self.dist[cell] = 0
+            self.pending.append(cell)
+
+    def remove_source(self, cell):
+        if cell not in self.sources:
+            return
+        self.sources.remove(cell)
+        if not self.sources:
+            self.reset()
+        elif not self.blocked[cell]:
+            self._raise(cell)
+
+    def block(self, cell):
+        if self.blocked[cell]:
+            return
+        self.blocked[cell] = 1
+        if self.dist[cell] < self.INF:
+            self._raise(cell)
+
+    def unblock(self, cell):
+        if not self.blocked[cell]:
+            return
+        self.blocked[cell] = 0
+        dist = self.dist
+        if cell in self.sources:
+            dist[cell] = 0
+        else:
+            dist[cell] = min(min([dist[nb] for nb in self.adj[cell]], default=self.INF) + 1, self.INF)
+        if dist[cell] < self.INF:
+            self.pending.append(cell)
+
+    def update(self, budget=None):
+        """Pass decreased distances on to neighbors, visiting at most budget cells (all if None).
+        Return True if all distances are exact, False if work is left for the next call.
+        """
+        dist, adj, blocked, queue = self.dist, self.adj, self.blocked, self.pending
+        if budget is None:
+            budget = -1
+        while queue and budget:
+            budget -= 1
+            cell = queue.popleft()
+            d = dist[cell] + 1
+            for nb in adj[cell]:
+                if d < dist[nb] and not blocked[nb]:
+                    dist[nb] = d
+                    queue.append(nb)
+        return not queue
+
+    def _raise(self, start):
+        """Fix distances after start cell stopped being a source or became blocked:
+        find cells that were only reachable through start, and route them anew
+        from their unaffected neighbors.
+        Every cell with a distance has a neighbor with smaller distance (its support),
+        that is what is checked, so that pending decreases do not matter.
+        """
+        dist, adj, blocked, INF = self.dist, self.adj, self.blocked, self.INF
+        affected = {start}
+        # candidates are decided in order of distance, when all affected cells closer are known
+        heap = [(dist[nb], nb) for nb in adj[start] if dist[start] < dist[nb] < INF]
+        heapq.heapify(heap)
+        while heap:
+            d, cell = heapq.heappop(heap)
+            if cell in affected or dist[cell] != d:
+                continue
+            for p in adj[cell]:
+                if dist[p] < d and p not in affected and not blocked[p]:
+                    break
+            else:
+                affected.add(cell)
+                if self.raise_limit is not None and len(affected) > self.raise_limit:
+                    self.reset()
+                    return
+                for nb in adj[cell]:
+                    if d < dist[nb] < INF and nb not in affected:
+                        heapq.heappush(heap, (dist[nb], nb))
+        for cell in affected:
+            dist[cell] = INF
+        seeds = []
+        for cell in affected:
+            if blocked[cell]:
+                continue
+            d = min([dist[nb] for nb in adj[cell]]) + 1
+            if d < INF:
+                dist[cell] = d
+                seeds.append(cell)
+        seeds.sort(key=dist.__getitem__)
+        self.pending.extend(seeds)
+
+
+def hamiltonian_cycle(grid):
+    """Cell ids of a cycle that visits every grid cell once, stepping between neighbors.
+    The cycle starts at (0, 0) and comes to it from (0, 1) where possible,
+    so that a snake starting at (0, 0) facing north lies along it.
+    Wrap around is only used if the grid with walls has no such cycle. Otherwise,
+    with walls and odd w and h cell (w - 1, 0) is left out, it is a neighbor
+    of both cells around (w - 2, 1) in the cycle.
+    Raises ValueError for grids with walls that are a single row or column.
+    """
+    w, h = grid.w, grid.h
+    if grid.wrap and (w % 2 and h % 2 or w < 2 or h < 2):
+        xys = _torus_cycle(w, h)
+    elif w < 2 or h < 2:
+        raise ValueError(f'No cycle in {w}x{h} grid')
+    elif h % 2 == 0:
+        xys = _zigzag_cycle(w, h)
+    elif w % 2 == 0:
+        xys = [(x, y) for y, x in _zigzag_cycle(h, w)]
+        xys = xys[:1] + xys[:0:-1]
+    else:
+        # cycle over rows 1.., with row 0 cells added in pairs to row 1
+        rest = [(x, y + 1) for x, y in _zigzag_cycle(w, h - 1)]
+        xys = []
+        for x in range(0, w - 1, 2):
+            xys += [(x, 0), (x + 1, 0), (x + 1, 1), (x + 2, 1)]
+        xys += rest[w:] + [(0, 1)]
+    return [grid.cell(x, y) for x, y in xys]
+
+
+def _zigzag_cycle(w, h):
+    """(x, y) of a cycle with walls for even h: row 0 to the east,
+    columns 1.. row by row back and forth, column 0 to the north.
+    """
+    xys = [(x, 0) for x in range(w)]
+    for y in range(1, h):
+        xs = range(w - 1, 0, -1) if y % 2 else range(1, w)
+        xys += [(x, y) for x in xs]
+    xys += [(0, y) for y in range(h - 1, 0, -1)]
+    return xys
+
+
+def _torus_cycle(w, h):
+    """(x, y) of a cycle with wrap around: every column is walked all the way around
+    to the north or south and then one step east. A north column shifts the start row
+    of the next one by one down and a south column by one up, and the shifts must add up
+    to a multiple of h. Column 0 goes north into (0, 0).
+    If no number of north columns fits, rows are walked east or west and then one step north.
+    """
+    for north in range(1, w + 1):
+        if (2 * north - w) % h == 0:
+            xys = []
+            y = h - 1
+            for x in range(w):
+                if x < north:
+                    xys += [(x, (y - i) % h) for i in range(h)]
+                    y = (y + 1) % h
+                else:
+                    xys += [(x, (y + i) % h) for i in range(h)]
+                    y = (y - 1) % h
+            return xys[h - 1:] + xys[:h - 1]
+    for east in range(1, h + 1):
+        if (h - 2 * east) % w == 0:
+            xys = []
+            x = 0
+            for i, y in enumerate([0, *range(h - 1, 0, -1)]):
+                if i < east:
+                    xys += [((x + j) % w, y) for j in range(w)]
+                    x = (x - 1) % w
+                else:
+                    xys += [((x - j) % w, y) for j in range(w)]
+                    x = (x + 1) % w
+            return xys
+    raise ValueError(f'No cycle in {w}x{h} grid')
+
+
 class Location:
+    """View of a single grid cell by coordinates."""
+    __slots__ = ('_grid', 'x', 'y')
+
     def __init__(self, grid, x, y):
         assert 0 <= x < grid.w
         assert 0 <= y < grid.h
@@ -58,6 +364,10 @@ class Location:
         yield self.x
         yield self.y
 
+    @property
+    def cell(self):
+        return self._grid.cell(self.x, self.y)
+
     def copy(self):
         return Location(self._grid, self.x, self.y)
 
@@ -72,15 +382,12 @@ class Location:
         return Location(self._grid, x, y)
 
     def step(self, dir_):
-        if dir_ == 'n':
-            return self.move(0, -1)
-        if dir_ == 'e':
-            return self.move(1, 0)
-        if dir_ == 's':
-            return self.move(0, 1)
-        if dir_ == 'w':
-            return self.move(-1, 0)
-        raise Exception(f'Unknown step direction: {dir_}')
+        if dir_ not in DIRECTIONS:
+            raise Exception(f'Unknown step direction: {dir_}')
+        cell = self._grid.step(self.cell, dir_)
+        if cell < 0:
+            return None
+        return self._grid.cell_loc(cell)
 
 
 def angle(dir_a, dir_b):
@@ -100,3 +407,67 @@ def test_angle():
     for d, a in zip('enws', (0, 90, 180, 270)):
         assert angle('e', d) == a
         assert angle(d, 'e') == -a % 360
+
+
+def test_occupancy():
+    grid = Grid(4, 3)
+    occ = Occupancy(grid)
+    loc = grid.loc(3, 2)
+    assert loc.cell == 11
+    occ[loc.cell] = 1
+    assert occ[grid.cell(3, 2)] == 1
+    assert occ.count(Occupancy.EMPTY) == 11
+    for cell in range(10):
+        occ[cell] = 2
+    assert occ.random_free() == 10
+    occ[10] = 2
+    assert occ.full() and occ.random_free() is None
+    occ[5] = Occupancy.EMPTY
+    assert occ.random_free() == 5
+    assert grid.cell_loc(5) == grid.loc(1, 1)
+
+
+def test_neighbors():
+    grid = Grid(3, 2)
+    assert grid.neighbors['n'] == [-1, -1, -1, 0, 1, 2]
+    assert grid.neighbors['e'] == [1, 2, -1, 4, 5, -1]
+    assert grid.loc(2, 1).step('e') is None
+    grid = Grid(3, 2, wrap_around=True)
+    assert grid.neighbors['w'] == [2, 0, 1, 5, 3, 4]
+    assert grid.step(grid.cell(1, 0), 'n') == grid.cell(1, 1)
+    assert grid.loc(0, 0).step('n') == grid.loc(0, 1)
+
+
+def test_distance_field():
+    for wrap in (False, True):
+        grid = Grid(7, 5, wrap)
+        field = DistanceField(grid)
+        full = DistanceField(grid)
+        rng = random.Random(wrap)
+        for i in range(1500):
+            if i == 1000:
+                field.raise_limit = 3
+            cell = rng.randrange(grid.w * grid.h)
+            op = rng.choice((field.add_source, field.remove_source, field.block, field.unblock))
+            op(cell)
+            # after first 500 changes, work is left pending between changes
+            if field.update(None if i < 500 else rng.randrange(3)):
+                full.sources, full.blocked = field.sources, field.blocked
+                full.reset()
+                full.update()
+                assert field.dist == full.dist
+
+
+def test_hamiltonian_cycle():
+    for w in range(1, 10):
+        for h in range(1, 10):
+            for wrap in (False, True):
+                grid = Grid(w, h, wrap)
+                if not wrap and (w < 2 or h < 2):
+                    continue
+                cycle = hamiltonian_cycle(grid)
+                odd = not wrap and w * h % 2
+                assert len(set(cycle)) == len(cycle) == w * h - odd, (w, h, wrap)
+                assert cycle[0] == 0
+                for a, b in zip(cycle, cycle[1:] + cycle[:1]):
+                    assert b in [grid.neighbors[d][a] for d in 'nesw'] or len(cycle) == 1, (w, h, wrap)
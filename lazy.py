@@ -0,0 +1,51 @@
+"""
+Lazy imports of heavy dependencies.
+"""
+
+import sys
+import types
+import importlib.util
+
+
+class _MissingModule(types.ModuleType):
+    """Stand-in for a module that is not installed, ImportError is raised when it is used."""
+    def __getattr__(self, attr):
+        raise ImportError(f'No module named {self.__name__!r}', name=self.__name__)
+
+
+def lazy_import(name):
+    """Module that is only executed when one of its attributes is first used.
+    Already imported modules are returned as is. If the module is not installed,
+    ImportError is raised on first use too, so that code not using it still works.
+    """
+    if sys.modules.get(name) is not None:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return _MissingModule(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def test_lazy_import():
+    import os
+    import subprocess
+    code = ('import sys, lazy; m = lazy.lazy_import("json"); '
+            'assert "json.decoder" not in sys.modules; m.dumps(1); '
+            'assert "json.decoder" in sys.modules')
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def test_missing_module():
+    module = lazy_import('no_such_module_here')
+    try:
+        module.anything
+    except ImportError as e:
+        assert e.name == 'no_such_module_here'
+    else:
+        assert False, 'ImportError not raised'
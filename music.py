@@ -3,31 +3,112 @@ Music manipulation.
 """
 
 import io
-import pygame
-from mido import MidiFile, bpm2tempo, tempo2bpm
+import threading
+from collections import OrderedDict
+
+from assets import read_bytes
+from lazy import lazy_import
+
+pygame = lazy_import('pygame')
+mido = lazy_import('mido')
 
 class Sounds:
     """Container for multiple sounds.
     Example:
     s = Sounds(moo='moo.wav', boo='boo.mp3')
     s.moo.play()
+    With loader (assets.AssetLoader), sounds are decoded in background,
+    and first use of a sound waits until it is ready.
+    With cache (assets.DiskCache), decoded samples are stored on disk.
     """
-    def __init__(self, **kwargs):
+    def __init__(self, loader=None, cache=None, **kwargs):
+        self._pending = {}
         for name, file in kwargs.items():
-            self.__dict__[name] = pygame.mixer.Sound(file)
+            if loader is None:
+                self.__dict__[name] = load_sound(file, cache)
+            else:
+                self._pending[name] = loader.load(file, load_sound, file, cache)
+
+    def __getattr__(self, name):
+        # only called for sounds that are not loaded yet
+        pending = self.__dict__.get('_pending', {})
+        if name not in pending:
+            raise AttributeError(name)
+        sound = pending.pop(name).result()
+        self.__dict__[name] = sound
+        return sound
+
+
+def load_sound(filename, cache=None):
+    """Sound from file. With cache, decoded samples are stored in it,
+    keyed by file contents and mixer format, and not decoded again next time.
+    """
+    if cache is None:
+        return pygame.mixer.Sound(filename)
+    key = cache.file_key(filename, 'pcm', pygame.mixer.get_init())
+    data = cache.get(key)
+    if data is not None:
+        return pygame.mixer.Sound(buffer=data)
+    sound = pygame.mixer.Sound(filename)
+    cache.put(key, sound.get_raw())
+    return sound
+
+
+_executor_instance = None
+
+def _executor():
+    """Single background thread that prepares MIDI data."""
+    global _executor_instance
+    if _executor_instance is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor_instance = ThreadPoolExecutor(max_workers=1, thread_name_prefix='music')
+    return _executor_instance
 
 
 class MidiMusic:
     """Class will start and stop infinite loop playback of a given MIDI file.
-    Tempo can be changed."""
-    def __init__(self, filename):
-        self.buffer = io.BytesIO()
-        self.mid = MidiFile(filename)
-        self.mid.save(file=self.buffer)
-        self.buffer.seek(0)
+    Tempo can be changed.
+    MIDI files for different tempos are built in a background thread and kept in
+    a bounded cache, call prepare() with tempos that will be needed.
+    With cache (assets.DiskCache), built files are also stored on disk, and the
+    MIDI file is only parsed if some tempo is not there yet.
+    midi is a file name, file contents or already parsed MidiFile.
+    """
+    def __init__(self, midi, max_variants=16, cache=None):
+        # mido is only imported if the file has to be parsed
+        if isinstance(midi, (bytes, str)):
+            self._mid = None
+            self.data = midi if isinstance(midi, bytes) else read_bytes(midi)
+        else:
+            self._mid = midi
+            buffer = io.BytesIO()
+            midi.save(file=buffer)
+            self.data = buffer.getvalue()
+        self._mid_lock = threading.Lock()
+        self.cache = cache
+        self._cache_key = cache and cache.key(self.data)
+        self.bpm = None
+        # futures with file bytes, keyed by bpm
+        self.variants = OrderedDict()
+        self.max_variants = max_variants
+        self.buffer = io.BytesIO(self.data)
         pygame.mixer.init()
         pygame.mixer.music.load(self.buffer)
 
+    @property
+    def mid(self):
+        """Parsed MidiFile, parsed on first use."""
+        with self._mid_lock:
+            if self._mid is None:
+                self._mid = mido.MidiFile(file=io.BytesIO(self.data))
+            return self._mid
+
+    def file_bpm(self):
+        """Tempo of the first "set_tempo" message in the file."""
+        for msg in self.mid.tracks[0]:
+            if msg.type == 'set_tempo':
+                return mido.tempo2bpm(msg.tempo)
+
     def start(self):
         pygame.mixer.music.play(-1)
 
@@ -45,33 +126,69 @@ class MidiMusic:
         # pygame.mixer.music.unpause()
         pygame.mixer.music.set_volume(self.volume_before_pause)
 
+    def prepare(self, bpms):
+        """Start building files for given tempos in background."""
+        for bpm in bpms:
+            self._variant(bpm)
+
+    def _variant(self, bpm):
+        """Future with bytes of MIDI file with tempo changed to bpm."""
+        if bpm in self.variants:
+            self.variants.move_to_end(bpm)
+            return self.variants[bpm]
+        future = _executor().submit(self._load, bpm)
+        self.variants[bpm] = future
+        while len(self.variants) > self.max_variants:
+            self.variants.popitem(last=False)
+        return future
+
+    def _load(self, bpm):
+        """Bytes of MIDI file with tempo changed to bpm, from disk cache if possible."""
+        if self.cache is None:
+            return self._build(bpm)
+        key = self.cache.key(self._cache_key, 'bpm', bpm)
+        return self.cache.cached(key, lambda: self._build(bpm))
+
+    def _build(self, bpm):
+        """Bytes of MIDI file with first "set_tempo" message changed to bpm.
+        Original MidiFile is not modified, so this can run in another thread.
+        """
+        tempo = mido.bpm2tempo(bpm)
+        mid = mido.MidiFile(type=self.mid.type, ticks_per_beat=self.mid.ticks_per_beat)
+        mid.tracks = list(self.mid.tracks)
+        track = mido.MidiTrack(mid.tracks[0])
+        for i, msg in enumerate(track):
+            if msg.type == 'set_tempo':
+                track[i] = msg.copy(tempo=tempo)
+                break
+        mid.tracks[0] = track
+        buffer = io.BytesIO()
+        mid.save(file=buffer)
+        return buffer.getvalue()
+
     def set_tempo(self, bpm=None, delta=None):
         """Set first "set_tempo" message to new bpm, or change bpm by delta.
         Integer delta for old+delta, float for old*(1+delta).
         Playback stops and needs to be restarted after."""
         assert not (bpm is None and delta is None)
-        track = self.mid.tracks[0]
-        for i, msg in enumerate(track):
-            if msg.type == 'set_tempo':
-                if bpm is None:
-                    old_bpm = tempo2bpm(msg.tempo)
-                    if isinstance(delta, int):
-                        bpm = old_bpm + delta
-                    elif isinstance(delta, float):
-                        bpm = old_bpm * (1 + delta)
-                    else:
-                        raise ValueError(f'Unexpected value of delta: {delta}')
-                tempo = bpm2tempo(bpm)
-
-                track[i] = msg.copy(tempo=tempo)
-                break
+        if bpm is None:
+            if self.bpm is None:
+                self.bpm = self.file_bpm()
+            if isinstance(delta, int):
+                bpm = self.bpm + delta
+            elif isinstance(delta, float):
+                bpm = self.bpm * (1 + delta)
+            else:
+                raise ValueError(f'Unexpected value of delta: {delta}')
+        data = self._variant(bpm).result()
+        self.bpm = bpm
 
         pygame.mixer.music.stop()
-        # pygame.mixer.music.unload() <-- will only be added in pygame 2.0. is it a potential memory leak?
+        if hasattr(pygame.mixer.music, 'unload'):
+            # only available since pygame 2.0
+            pygame.mixer.music.unload()
         self.buffer.close()
-        self.buffer = io.BytesIO()
-        self.mid.save(file=self.buffer)
-        self.buffer.seek(0)
+        self.buffer = io.BytesIO(data)
         pygame.mixer.music.load(self.buffer)
 
 
@@ -0,0 +1,129 @@
+"""
+Frame profiler: durations of frame phases in recent frames.
+"""
+
+import json
+import time
+from collections import deque
+
+
+def percentile(sorted_values, p):
+    """Value below which p percent of sorted_values are, nearest rank."""
+    if not sorted_values:
+        return 0
+    i = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[i]
+
+
+class FrameProfiler:
+    """Records start and end time of named phases within frames,
+    keeps max_frames most recent frames in a ring buffer.
+
+    profiler.begin_frame()
+    profiler.begin('render')
+    profiler.begin('flip')  # phases can be nested
+    profiler.end()
+    profiler.end()
+    profiler.end_frame()
+
+    Every frame is a list of [name, start, end, depth], first item is the whole frame.
+    """
+    def __init__(self, max_frames=600):
+        self.frames = deque(maxlen=max_frames)
+        self._frame = None
+        self._stack = []
+
+    def begin_frame(self):
+        self._frame = [['frame', time.perf_counter(), None, 0]]
+        self._stack = [self._frame[0]]
+
+    def end_frame(self):
+        if self._frame is None:
+            return
+        now = time.perf_counter()
+        # close phases left open
+        for phase in self._stack:
+            phase[2] = now
+        self.frames.append(self._frame)
+        self._frame = None
+        self._stack = []
+
+    def begin(self, name):
+        if self._frame is None:
+            return
+        phase = [name, time.perf_counter(), None, len(self._stack)]
+        self._frame.append(phase)
+        self._stack.append(phase)
+
+    def end(self):
+        if len(self._stack) > 1:
+            self._stack.pop()[2] = time.perf_counter()
+
+    def durations(self, name):
+        """Total duration of phase name in every recorded frame, seconds."""
+        result = []
+        for frame in self.frames:
+            result.append(sum(end - start for n, start, end, _ in frame if n == name))
+        return result
+
+    def phase_names(self):
+        """Names of recorded phases in order of first appearance."""
+        names = {}
+        for frame in self.frames:
+            for name, *_ in frame:
+                names.setdefault(name, None)
+        return list(names)
+
+    def worst_frame(self):
+        """Longest recorded frame, or None."""
+        if not self.frames:
+            return None
+        return max(self.frames, key=lambda frame: frame[0][2] - frame[0][1])
+
+    def summary(self):
+        """Lines of text: percentiles of phase durations and phases of the worst frame."""
+        lines = [f'{len(self.frames)} frames, ms   p50    p95    p99    max']
+        for name in self.phase_names():
+            d = sorted(self.durations(name))
+            ms = [percentile(d, p) * 1000 for p in (50, 95, 99, 100)]
+            lines.append(f'{name:14}' + ''.join(f'{x:7.2f}' for x in ms))
+        worst = self.worst_frame()
+        if worst is not None:
+            lines.append('worst frame')
+            for name, start, end, depth in worst:
+                lines.append(f'{"  " * depth}{name:14}{(end - start) * 1000:7.2f}')
+        return lines
+
+    def trace(self):
+        """Recorded frames as Chrome trace events (chrome://tracing, ui.perfetto.dev)."""
+        events = []
+        for frame in self.frames:
+            for name, start, end, _ in frame:
+                events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': start * 1e6, 'dur': (end - start) * 1e6})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_trace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+def test_FrameProfiler():
+    prof = FrameProfiler(max_frames=3)
+    prof.begin('outside frame')
+    prof.end()
+    for _ in range(5):
+        prof.begin_frame()
+        prof.begin('logic')
+        prof.begin('move')
+        prof.end()
+        prof.end()
+        prof.begin('render')
+        prof.end_frame()
+    assert len(prof.frames) == 3
+    assert prof.phase_names() == ['frame', 'logic', 'move', 'render']
+    assert [p[3] for p in prof.frames[0]] == [0, 1, 2, 1]
+    assert all(end >= start for frame in prof.frames for _, start, end, _ in frame)
+    assert len(prof.trace()['traceEvents']) == 12
+    assert len(prof.summary()) == 1 + 4 + 1 + 4
+    assert percentile([1, 2, 3, 4], 50) == 2 and percentile([1, 2, 3, 4], 100) == 4
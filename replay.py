@@ -0,0 +1,326 @@
+"""
+Recording games and replaying them.
+
+A game is reproduced from the engine seed, game config and the steps at which
+the snake turned. Periodic snapshots of the complete engine state allow to
+start playback from any step without simulating the game from the beginning.
+Replay file format, all integers are unsigned LEB128 varints:
+
+    b'SNKR', format version (1 byte)
+    number of config fields, config values in CONFIG_FIELDS order
+    seed
+    turns: (steps since previous turn) << 2 | direction index in DIRS,
+        first turn counts from step -1, so that values below 4 never occur
+    snapshots among turns: SNAPSHOT, step, length, encoded engine state
+    0, number of steps
+
+Engine state keeps the order of free cells, since apples are placed by position
+in that list. It is stored as zlib compressed differences of successive
+cells. The list starts sorted and gets shuffled as the snake moves,
+and a shuffled list of n cells can not take less than log2(n!) bits: a state of
+the default game is about 2.8 KB, mostly the rng state, but on 100x100 it grows
+from about 3 KB at the start of a level to 19 KB, against 22 KB uncompressed.
+"""
+
+import io
+import zlib
+import struct
+import bisect
+
+import gridlib
+import engine
+
+
+MAGIC = b'SNKR'
+VERSION = 1
+DIRS = 'nesw'
+# marker of snapshot record among turns
+SNAPSHOT = 1
+# steps between snapshots, state of default game is about 2.8 KB
+SNAPSHOT_INTERVAL = 2000
+CONFIG_FIELDS = ('grid_w', 'grid_h', 'wrap', 'start_size', 'win_size', 'win_level',
+                 'good_apples', 'bad_apples', 'start_speed')
+
+
+def write_varint(f, n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    f.write(out)
+
+
+def read_varint(f):
+    n = shift = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            raise EOFError('Replay ended unexpectedly')
+        n |= (b[0] & 0x7f) << shift
+        if b[0] < 0x80:
+            return n
+        shift += 7
+
+
+def encode_state(state):
+    """Bytes of engine.Engine.get_state()."""
+    (level, size, score, facing, backward, segs, apple_cells, waiting, free,
+     (rng_version, mt, gauss)) = state
+    f = io.BytesIO()
+    for n in (level, size, score, DIRS.index(facing), DIRS.index(backward)):
+        write_varint(f, n)
+    for seq in (segs, [0 if c is None else c + 1 for c in apple_cells], waiting):
+        write_varint(f, len(seq))
+        for n in seq:
+            write_varint(f, n)
+    # differences of successive free cells, zigzag encoded so that small negative ones stay small
+    deltas = io.BytesIO()
+    prev = -1
+    for cell in free:
+        d = cell - prev
+        write_varint(deltas, d << 1 if d >= 0 else -d << 1 | 1)
+        prev = cell
+    packed = zlib.compress(deltas.getvalue())
+    write_varint(f, len(free))
+    write_varint(f, len(packed))
+    f.write(packed)
+    write_varint(f, rng_version)
+    f.write(struct.pack(f'<{len(mt)}I', *mt))
+    f.write(b'\0' if gauss is None else b'\1' + struct.pack('<d', gauss))
+    return f.getvalue()
+
+
+def decode_state(data):
+    """Engine state from encode_state() bytes."""
+    f = io.BytesIO(data)
+    level, size, score, facing, backward = [read_varint(f) for _ in range(5)]
+    seqs = []
+    for _ in range(3):
+        n = read_varint(f)
+        seqs.append(tuple(read_varint(f) for _ in range(n)))
+    n = read_varint(f)
+    deltas = io.BytesIO(zlib.decompress(f.read(read_varint(f))))
+    free = []
+    cell = -1
+    for _ in range(n):
+        d = read_varint(deltas)
+        cell += -(d >> 1) if d & 1 else d >> 1
+        free.append(cell)
+    seqs.append(tuple(free))
+    segs, apple_cells, waiting, free = seqs
+    apple_cells = tuple(None if c == 0 else c - 1 for c in apple_cells)
+    rng_version = read_varint(f)
+    # Mersenne Twister state is 624 words and position
+    mt = struct.unpack('<625I', f.read(625 * 4))
+    gauss = struct.unpack('<d', f.read(8))[0] if f.read(1) == b'\1' else None
+    return (level, size, score, DIRS[facing], DIRS[backward], segs, apple_cells, waiting, free,
+            (rng_version, mt, gauss))
+
+
+def new_engine(config, seed):
+    """Engine of a game with given config dict, fields of CONFIG_FIELDS, and seed."""
+    grid = gridlib.Grid(config['grid_w'], config['grid_h'], bool(config['wrap']))
+    return engine.Engine(grid, config['start_size'], config['win_size'], config['win_level'],
+                         config['good_apples'], config['bad_apples'], seed=seed)
+
+
+class Replay:
+    """Recorded game: config dict, engine seed, turns as {step: direction}, number of steps,
+    and snapshots as sorted lists of steps and encoded engine states before those steps.
+    """
+    def __init__(self, config, seed, turns, steps, snapshot_steps=(), snapshots=()):
+        self.config = config
+        self.seed = seed
+        self.turns = turns
+        self.steps = steps
+        self.snapshot_steps = list(snapshot_steps)
+        self.snapshots = list(snapshots)
+
+    def new_engine(self):
+        return new_engine(self.config, self.seed)
+
+    def engine_at(self, step, eng=None):
+        """Engine in the state before given step, restored from the nearest snapshot,
+        so at most snapshot interval steps are simulated.
+        eng is an engine of this replay to reuse, e.g. one that is displayed.
+        """
+        if eng is None:
+            eng = self.new_engine()
+        i = bisect.bisect_right(self.snapshot_steps, step) - 1
+        if i >= 0:
+            start = self.snapshot_steps[i]
+            eng.set_state(decode_state(self.snapshots[i]))
+        else:
+            start = 0
+            eng.new_game(self.seed)
+        for _ in self.play(eng, start, step):
+            pass
+        return eng
+
+    def play(self, eng=None, start=0, stop=None):
+        """Re-simulate the game from start to stop step, yield (step, result) for every step.
+        eng must be in the state before start step, new engine is used if not given.
+        Levels are advanced like in the game.
+        """
+        if eng is None:
+            eng = self.engine_at(start)
+        for step in range(start, self.steps if stop is None else stop):
+            result = eng.step(self.turns.get(step))
+            if result == 'level_up':
+                eng.level_up()
+            yield step, result
+
+
+def read_replay(f):
+    """Replay from binary file object.
+    Replay that was cut short (program crashed) ends after the last recorded turn.
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a replay file')
+    version = f.read(1)[0]
+    if version != VERSION:
+        raise ValueError(f'Unsupported replay version {version}')
+    n = read_varint(f)
+    values = [read_varint(f) for _ in range(n)]
+    config = dict(zip(CONFIG_FIELDS, values))
+    seed = read_varint(f)
+    turns = {}
+    snapshot_steps = []
+    snapshots = []
+    step = -1
+    while True:
+        try:
+            v = read_varint(f)
+            if v == SNAPSHOT:
+                snapshot_step = read_varint(f)
+                length = read_varint(f)
+                data = f.read(length)
+                if len(data) < length:
+                    raise EOFError('Replay ended unexpectedly')
+                snapshot_steps.append(snapshot_step)
+                snapshots.append(data)
+                continue
+        except EOFError:
+            steps = max([step + 1] + snapshot_steps)
+            return Replay(config, seed, turns, steps, snapshot_steps, snapshots)
+        if v == 0:
+            break
+        step += v >> 2
+        turns[step] = DIRS[v & 3]
+    return Replay(config, seed, turns, read_varint(f), snapshot_steps, snapshots)
+
+
+def load(filename):
+    with open(filename, 'rb') as f:
+        return read_replay(f)
+
+
+class Recorder:
+    """Writes replay of an engine game to a binary file object while it is played.
+    Set engine.recorder to it, and call close() when the game is over.
+    config is a dict with CONFIG_FIELDS.
+    Engine state is saved every snapshot_interval steps, 0 for none.
+    """
+    def __init__(self, f, config, seed, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.f = f
+        self.snapshot_interval = snapshot_interval
+        self.steps = 0
+        self.last_turn = -1
+        self._snake = None
+        self._facing = None
+        f.write(MAGIC + bytes([VERSION]))
+        write_varint(f, len(CONFIG_FIELDS))
+        for field in CONFIG_FIELDS:
+            write_varint(f, int(config[field]))
+        write_varint(f, seed)
+
+    def record(self, eng):
+        """Called by engine before every step, records facing if it has changed."""
+        snake = eng.snake
+        if snake is not self._snake:
+            # new level
+            self._snake = snake
+            self._facing = engine.START_FACING
+        if snake.facing != self._facing:
+            self._facing = snake.facing
+            write_varint(self.f, (self.steps - self.last_turn) << 2 | DIRS.index(snake.facing))
+            self.last_turn = self.steps
+        if self.snapshot_interval and self.steps and self.steps % self.snapshot_interval == 0:
+            data = encode_state(eng.get_state())
+            write_varint(self.f, SNAPSHOT)
+            write_varint(self.f, self.steps)
+            write_varint(self.f, len(data))
+            self.f.write(data)
+        self.steps += 1
+
+    def finish(self):
+        """Write end of replay."""
+        write_varint(self.f, 0)
+        write_varint(self.f, self.steps)
+
+    def close(self):
+        self.finish()
+        self.f.close()
+
+
+def open_recorder(filename, config, seed, snapshot_interval=SNAPSHOT_INTERVAL):
+    """Recorder writing to a file through a buffer."""
+    return Recorder(open(filename, 'wb', buffering=io.DEFAULT_BUFFER_SIZE), config, seed, snapshot_interval)
+
+
+def test_encode_state():
+    config = dict(grid_w=10, grid_h=8, wrap=0, start_size=3, win_size=6, win_level=3,
+                  good_apples=2, bad_apples=3, start_speed=6)
+    eng = Replay(config, 1, {}, 0).new_engine()
+    eng.step('e')
+    eng.apples[0].cell = None
+    eng.waiting = [eng.apples[0]]
+    state = eng.get_state()
+    assert decode_state(encode_state(state)) == state
+    # free cells out of order
+    eng = engine.Engine(gridlib.Grid(30, 30), 3, 10, 1, 1, 5, seed=0)
+    eng.rng.shuffle(eng.occ.free)
+    state = eng.get_state()
+    assert decode_state(encode_state(state)) == state
+
+
+def test_varint():
+    f = io.BytesIO()
+    numbers = [0, 1, 127, 128, 300, 2**64 - 1]
+    for n in numbers:
+        write_varint(f, n)
+    f.seek(0)
+    assert [read_varint(f) for _ in numbers] == numbers
+
+
+def test_replay():
+    import random
+    config = dict(grid_w=10, grid_h=8, wrap=0, start_size=3, win_size=6, win_level=3,
+                  good_apples=2, bad_apples=3, start_speed=6)
+    rng = random.Random(1)
+    for game in range(20):
+        f = io.BytesIO()
+        rep = Replay(config, game, {}, 0)
+        eng = rep.new_engine()
+        recorder = eng.recorder = Recorder(f, config, eng.seed, snapshot_interval=10)
+        results = []
+        while True:
+            result = eng.step(rng.choice('nesw') if rng.random() < 0.3 else None)
+            results.append(result)
+            if result == 'level_up':
+                eng.level_up()
+            elif result in ('win', 'self', 'wall', 'size_zero'):
+                break
+        recorder.finish()
+
+        f.seek(0)
+        rep = read_replay(f)
+        assert rep.config == config and rep.seed == game and rep.steps == len(results)
+        assert rep.snapshot_steps == list(range(10, len(results), 10))
+        eng2 = rep.new_engine()
+        assert [result for _, result in rep.play(eng2)] == results
+        assert eng2.get_state() == eng.get_state()
+        # seeking
+        for step in {0, 9, 10, 25, len(results) - 1} & set(range(len(results))):
+            assert [r for _, r in rep.play(start=step)] == results[step:]
@@ -0,0 +1,28 @@
+"""
+Game rules: field, snake sizes, levels and apples.
+
+Defaults of the game in snake.py and of headless tools like tournament.py,
+kept in a module of their own so that they are read without pygame.
+"""
+
+# Fild size in tiles
+GRID_W, GRID_H = 15, 15
+# Wrap around field walls
+WRAP_AROUND_BOUNDS = False
+# New snake length
+START_SIZE = 3
+# Snake length to win a level
+WIN_SIZE = 10
+# How many level to win the game
+WIN_LEVEL = 10
+# New snake speed, tiles per second
+START_SPEED = 6
+# Number of good apples
+GOOD_APPLES = 1
+# Number of bad apples
+BAD_APPLES = 5
+
+# replay config fields and constants they are stored from
+REPLAY_CONFIG = dict(grid_w='GRID_W', grid_h='GRID_H', wrap='WRAP_AROUND_BOUNDS',
+                     start_size='START_SIZE', win_size='WIN_SIZE', win_level='WIN_LEVEL',
+                     good_apples='GOOD_APPLES', bad_apples='BAD_APPLES', start_speed='START_SPEED')
@@ -2,44 +2,116 @@
 Classic snake game.
 """
 
+import io
+import os
 import sys
+import time
 import enum
 from types import SimpleNamespace
 import math
 
-import pygame
-
 import gridlib
-from text import TextSprite, max_font_size_in_rect
+import engine
+import rules
+from text import TextSprite, render_text, max_font_size_in_rect, set_disk_cache
 from music import Sounds, MidiMusic
+from assets import AssetLoader, DiskCache, read_bytes
+from profiler import FrameProfiler
+import replay
+import bots
+from lazy import lazy_import
+
+# loaded on first use, so that constants and helpers can be imported without pygame
+pygame = lazy_import('pygame')
 
 
 ##############################################
 # Change these constants to modify game mode #
 ##############################################
-# Fild size in tiles
-GRID_W, GRID_H = 15, 15
+# Field size, wrap around walls, snake sizes, speed, levels and apples are set in rules.py,
+# shared with headless tools, change them there or with configure() below
+from rules import (GRID_W, GRID_H, WRAP_AROUND_BOUNDS, START_SIZE, WIN_SIZE, WIN_LEVEL,
+                   START_SPEED, GOOD_APPLES, BAD_APPLES)
 # Tile size in pixels
 TILE_W, TILE_H = 32, 32
-# Wrap around field walls
-WRAP_AROUND_BOUNDS = False
-# New snake length
-START_SIZE = 3
-# Snake length to win a level
-WIN_SIZE = 10
-# How many level to win the game
-WIN_LEVEL = 10
-# New snake speed, tiles per second
-START_SPEED = 6
-# Number of good apples
-GOOD_APPLES = 1
-# Number of bad apples
-BAD_APPLES = 5
-
-
-GRID = gridlib.Grid(GRID_W, GRID_H, WRAP_AROUND_BOUNDS)
-TILE = pygame.Rect(0, 0, TILE_W, TILE_H)
-SCREEN = pygame.Rect(0, 0, GRID_W * TILE_W, GRID_H * TILE_H)
+# Redraw only changed tiles and text instead of the whole screen every frame
+DIRTY_RECTS = True
+# Frames per second limit, 0 for uncapped
+FPS = 60
+# Sync frames to display refresh instead of FPS limit (pygame 2)
+VSYNC = False
+# Snake speed multiplier, steps are not limited by FPS
+SPEED_FACTOR = 1
+# Keep decoded sounds, MIDI tempo variants, intro screen and texts in a cache directory
+ASSET_CACHE = True
+# Record duration of frame phases: F3 toggles overlay, F4 saves trace to PROFILE_TRACE,
+# off by default, phases are then not timed
+PROFILE = False
+PROFILE_TRACE = 'frame_trace.json'
+# Sleep until input or timer when nothing moves on screen (pygame 2)
+IDLE_WAIT = True
+# Directory to save replay of every game to, None to not record
+REPLAY_DIR = None
+# Snake is steered by a bot, P toggles
+AUTOPILOT = False
+# Name of the autopilot class in bots: CycleBot never loses, PathBot takes shorter paths
+AUTOPILOT_BOT = 'CycleBot'
+
+
+def init_layout():
+    """Build GRID, TILE and SCREEN globals from the constants above, if not built yet."""
+    for name in ('GRID', 'TILE', 'SCREEN'):
+        if name not in globals():
+            globals()[name] = _layout(name)
+
+
+def _layout(name):
+    if name == 'GRID':
+        return gridlib.Grid(GRID_W, GRID_H, WRAP_AROUND_BOUNDS)
+    if name == 'TILE':
+        return pygame.Rect(0, 0, TILE_W, TILE_H)
+    return pygame.Rect(0, 0, GRID_W * TILE_W, GRID_H * TILE_H)
+
+
+def __getattr__(name):
+    # GRID, TILE and SCREEN are built on first access from outside of the module,
+    # GRID without importing pygame
+    if name in ('GRID', 'TILE', 'SCREEN'):
+        globals()[name] = _layout(name)
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def configure(**constants):
+    """Change constants above, e.g. configure(GRID_W=20), before Game() is created."""
+    g = globals()
+    for name, value in constants.items():
+        if not name.isupper() or name not in g:
+            raise NameError(f'Unknown constant {name}')
+        g[name] = value
+    for name in ('GRID', 'TILE', 'SCREEN'):
+        g.pop(name, None)
+
+
+# replay config fields and constants they are stored from
+REPLAY_CONFIG = rules.REPLAY_CONFIG
+
+
+def replay_config():
+    """Game constants stored in replays."""
+    return {field: globals()[name] for field, name in REPLAY_CONFIG.items()}
+
+
+def level_speed(level):
+    """Snake speed on given level, steps per second."""
+    return START_SPEED + level - 1
+
+
+def speed_to_bpm(speed):
+    """Music tempo matching snake speed."""
+    steps_per_minute = speed * 60
+    steps_per_beat = 2
+    return steps_per_minute / steps_per_beat
 
 
 def coord_rel_to_abs(coords, rect):
@@ -53,22 +125,96 @@ def coord_rel_to_abs(coords, rect):
 
 
 class COLOR(SimpleNamespace):
-    BACKGROUND = pygame.Color('black')
-    GRID_LINE = pygame.Color('gray')
+    BACKGROUND = (0, 0, 0)
+    GRID_LINE = (190, 190, 190)
+
+
+# tile images shared by all sprites, keyed by (kind, colors, tile size)
+_tile_images = {}
+
+
+def tile_image(kind, colors):
+    """Shared image for tile sprites, drawn and converted once per kind, colors and tile size.
+    kind is 'apple' (colors is fill color), 'segment' or 'head_n', 'head_e', 'head_s', 'head_w'
+    (colors is (fill, edge) pair).
+    """
+    key = (kind, colors, TILE.size)
+    if key in _tile_images:
+        return _tile_images[key]
+    if kind == 'apple':
+        image = _draw_apple(colors)
+    elif kind == 'segment':
+        image = _draw_segment(colors)
+    elif kind == 'head_n':
+        image = _draw_head(colors)
+    elif kind.startswith('head_'):
+        image = pygame.transform.rotate(tile_image('head_n', colors), gridlib.angle('n', kind[-1]))
+    else:
+        raise ValueError(f'Unknown tile kind: {kind}')
+    if pygame.display.get_surface() is not None:
+        image = image.convert()
+    image.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+    _tile_images[key] = image
+    return image
+
+
+def _draw_apple(color):
+    image = pygame.Surface(TILE.size)
+    pygame.draw.ellipse(image, color, image.get_rect())
+    return image
+
+
+def _draw_segment(colors):
+    cfill, cedge = colors
+    image = pygame.Surface(TILE.size)
+    rect = image.get_rect()
+    pygame.draw.ellipse(image, cedge, rect)
+    fill_circle = rect.inflate(-int(0.25 * TILE.w), -int(0.25 * TILE.h))
+    pygame.draw.ellipse(image, cfill, fill_circle)
+    return image
+
+
+def _draw_head(colors):
+    cfill, cedge = colors
+    image = pygame.Surface(TILE.size)
+    image_rect = image.get_rect()
+
+    # draw north-facing head
+    # to have symmetry, draw left half and flip
+
+    # note: due to rounding in coord_rel_to_abs(), this will leave a gap if tile width is odd
+    contour_rel = ((0.5, 1), (0, 1), (0, 0.5), (0.2, 0), (0.5, 0))
+    contour_abs = [coord_rel_to_abs(c, image_rect) for c in contour_rel]
+    pygame.draw.polygon(image, cfill, contour_abs)
+
+    nose_size = (math.ceil(TILE.w * 0.05), math.ceil(TILE.h * 0.05))
+    nose_left_top = coord_rel_to_abs((0.3, 0.1), image_rect)
+    nose = pygame.Rect(nose_left_top, nose_size)
+    pygame.draw.rect(image, cedge, nose)
+
+    eye_size = (math.ceil(TILE.w * 0.1), math.ceil(TILE.h * 0.1))
+    eye_left_top = coord_rel_to_abs((0.2, 0.5), image_rect)
+    eye = pygame.Rect(eye_left_top, eye_size)
+    pygame.draw.rect(image, cedge, eye)
+
+    right_side = pygame.transform.flip(image, True, False)
+    right_side.set_colorkey((0, 0, 0))
+    image.blit(right_side, image_rect)
+    return image
 
 
 class TileSprite:
-    """Base class to represent single tile sprites."""
-    def __init__(self):
-        self.image = pygame.Surface((TILE.w, TILE.h))
-        self.transparent_color = (0, 0, 0)
-        self.image.set_colorkey(self.transparent_color, pygame.RLEACCEL)
+    """Base class to represent single tile sprites.
+    Sprites of the same kind share one image from tile_image().
+    """
+    def __init__(self, image):
+        self.image = image
         self.rect = TILE.copy()
-        self.loc = None
 
-    def _update_rect(self):
-        self.rect.x = self.loc.x * TILE.w
-        self.rect.y = self.loc.y * TILE.h
+    def move(self, x, y):
+        """Move sprite to (x, y) location on grid."""
+        self.rect.x = x * TILE.w
+        self.rect.y = y * TILE.h
 
     def blit(self, surf):
         """Blit sprite image onto surface."""
@@ -77,95 +223,45 @@ class TileSprite:
 
 class Apple(TileSprite):
     """Apple that the snake eats to grow."""
-    def __init__(self, good, infeasible_locs):
-        super().__init__()
-        self.good = good
+    def __init__(self, good):
         color = (0, 255, 0) if good else (150, 75, 0)
-        pygame.draw.ellipse(self.image, color, self.rect)
-        self.move(infeasible_locs)
-
-    def move(self, infeasible_locs):
-        """Move apple to random location, do not move on snake or other apples."""
-        feasible = False
-        while not feasible:
-            new_loc = GRID.random_loc()
-            if new_loc not in infeasible_locs:
-                feasible = True
-        self.loc = new_loc
-        self._update_rect()
+        super().__init__(tile_image('apple', color))
+        self.good = good
 
 
 class SnakeSegment(TileSprite):
     """Single segment of a snake."""
     def __init__(self, x, y, colors):
-        super().__init__()
-        cfill, cedge = colors
-        pygame.draw.ellipse(self.image, cedge, self.rect)
-        fill_circle = self.rect.inflate(-int(0.25 * TILE.w), -int(0.25 * TILE.h))
-        pygame.draw.ellipse(self.image, cfill, fill_circle)
+        super().__init__(tile_image('segment', colors))
         self.move(x, y)
 
-    def move(self, x, y):
-        """Move segment to (x, y) location on grid."""
-        self.loc = GRID.loc(x, y)
-        self._update_rect()
-
 
-class SnakeHead(SnakeSegment):
-    """Snake head."""
+class SnakeHead(TileSprite):
+    """Snake head. Turning only switches between pre-rendered images."""
     def __init__(self, x, y, facing, colors):
-        cfill, cedge = colors
-        super().__init__(x, y, colors)
-        # erase segment
-        self.image.fill(self.transparent_color)
-
-        # draw north-facing head
-        # to have symmetry, draw left half and flip
-        image_rect = self.image.get_rect()
-
-        # note: due to rounding in coord_rel_to_abs(), this will leave a gap if tile width is odd
-        contour_rel = ((0.5, 1), (0, 1), (0, 0.5), (0.2, 0), (0.5, 0))
-        contour_abs = [coord_rel_to_abs(c, image_rect) for c in contour_rel]
-        pygame.draw.polygon(self.image, cfill, contour_abs)
-
-        nose_size = (math.ceil(TILE.w * 0.05), math.ceil(TILE.h * 0.05))
-        nose_left_top = coord_rel_to_abs((0.3, 0.1), image_rect)
-        nose = pygame.Rect(nose_left_top, nose_size)
-        pygame.draw.rect(self.image, cedge, nose)
-
-        eye_size = (math.ceil(TILE.w * 0.1), math.ceil(TILE.h * 0.1))
-        eye_left_top = coord_rel_to_abs((0.2, 0.5), image_rect)
-        eye = pygame.Rect(eye_left_top, eye_size)
-        pygame.draw.rect(self.image, cedge, eye)
-
-        right_side = pygame.transform.flip(self.image, True, False)
-        self.image.blit(right_side, image_rect)
-
-        self.facing = 'n'
-        self.turn(facing)
+        self.images = {d: tile_image('head_' + d, colors) for d in 'nesw'}
+        super().__init__(self.images[facing])
+        self.facing = facing
+        self.move(x, y)
 
     def turn(self, facing):
-        rotation = gridlib.angle(self.facing, facing)
-        self.image = pygame.transform.rotate(self.image, rotation)
+        self.image = self.images[facing]
         self.facing = facing
 
 
 class Snake:
-    """Snake consisting of multiple segments."""
-    def __init__(self, head_loc, facing, size, level):
-        self.facing = facing
-        self.backward = gridlib.opposite_dir(facing)
+    """Snake sprites drawn over the body of engine snake."""
+    def __init__(self, body, level):
+        self.body = body
         # speed in steps per second
-        self.speed = START_SPEED + level - 1
-        self.delay = 1000 // self.speed
+        self.speed = level_speed(level)
+        # milliseconds between steps
+        self.step_interval = 1000 / (self.speed * SPEED_FACTOR)
         self.colors = self._colors_from_level(level)
-        self.last_moved = pygame.time.get_ticks()
-        head = SnakeHead(*head_loc, facing, self.colors)
-        self.segs = [head]
-        seg_loc = head.loc
-        for _ in range(1, size):
-            seg_loc = seg_loc.step(self.backward)
-            self.segs.append(SnakeSegment(*seg_loc, self.colors))
+        head_xy = GRID.xy(body.segs[0])
+        self.head = SnakeHead(*head_xy, body.facing, self.colors)
+        # single segment sprite is moved around to draw every segment
+        self.seg = SnakeSegment(*head_xy, self.colors)
 
     @staticmethod
     def _colors_from_level(level):
@@ -183,95 +279,76 @@ class Snake:
         return fill, edge
 
     def __len__(self):
-        return len(self.segs)
+        return len(self.body)
+
+    @property
+    def backward(self):
+        return self.body.backward
 
     def speed_to_bpm(self):
-        steps_per_second = self.speed
-        steps_per_minute = steps_per_second * 60
-        steps_per_beat = 2
-        return steps_per_minute / steps_per_beat
+        return speed_to_bpm(self.speed)
 
     def turn(self, facing):
         """Change facing direction. Can not turn backward."""
-        if facing != self.backward:
-            self.facing = facing
-            self.segs[0].turn(facing)
-
-    def move(self, apples):
-        """
-        Move in the facing direction and return result. Grow if got apple.
-        Returns: None (no move), 'move', 'apple', 'self', 'wall' or 'size_zero'.
-        """
-        now = pygame.time.get_ticks()
-        if now - self.last_moved < self.delay:
-            return None
-
-        head = self.segs[0]
-        new_loc = head.loc.step(self.facing)
-
-        if new_loc is None:
-            return 'wall'
+        self.body.turn(facing)
+        if self.head.facing != self.body.facing:
+            self.head.turn(self.body.facing)
 
-        hit_apple = None
-        for apple in apples:
-            if new_loc == apple.loc:
-                hit_apple = apple
-                break
-
-        if hit_apple is not None:
-            result = hit_apple
-            if hit_apple.good:
-                new_neck = SnakeSegment(*head.loc, self.colors)
-                self.segs.insert(1, new_neck)
-            else:
-                if len(self) == 1:
-                    return 'size_zero'
-                elif len(self) == 2:
-                    # head + 1 segment: delete that segment
-                    self.segs.pop()
-                elif len(self) > 2:
-                    # head + 2 or more segments: delete tail, move pre-tail
-                    self.segs.pop()
-                    tail = self.segs.pop()
-                    tail.move(*head.loc)
-                    self.segs.insert(1, tail)
-
-            head.move(*new_loc)
-        elif self.collide(new_loc):
-            result = 'self'
-        else:
-            result = 'move'
-            tail = self.segs.pop()
-            tail.move(*head.loc)
-            self.segs.insert(1, tail)
-            head.move(*new_loc)
-
-        self.backward = gridlib.opposite_dir(self.facing)
-        self.last_moved = now
-        return result
-
-    def collide(self, loc):
-        """Test if loc collides with any segment."""
-        return any(loc == seg.loc for seg in self.segs)
+    def blit_cell(self, surf, cell):
+        """Blit image of the segment in cell onto surface."""
+        sprite = self.head if cell == self.body.segs[0] else self.seg
+        sprite.move(*GRID.xy(cell))
+        sprite.blit(surf)
 
     def blit(self, surf):
         """Blit whole snake images onto surface."""
-        for seg in self.segs:
-            seg.blit(surf)
+        segs = iter(self.body.segs)
+        self.head.move(*GRID.xy(next(segs)))
+        self.head.blit(surf)
+        for cell in segs:
+            self.seg.move(*GRID.xy(cell))
+            self.seg.blit(surf)
+
+
+def cached_image(cache, size, draw, *key):
+    """Surface of given size with draw(surface) called on it.
+    With cache (assets.DiskCache), pixels are stored on disk under key parts,
+    so that draw() is not called again next time.
+    """
+    if cache is not None:
+        key = cache.key('image', size, pygame.version.ver, *key)
+        data = cache.get(key)
+        if data is not None:
+            return pygame.image.fromstring(data, size, 'RGBX').convert()
+    image = pygame.Surface(size).convert()
+    draw(image)
+    if cache is not None:
+        cache.put(key, pygame.image.tostring(image, 'RGBX'))
+    return image
 
 
 class IntroScreen:
-    def __init__(self):
+    def __init__(self, cache=None):
         self.rect = pygame.display.get_surface().get_rect()
-        self.image = pygame.Surface(self.rect.size).convert()
-        self.image.fill(COLOR.BACKGROUND)
+        self.image = cached_image(cache, self.rect.size, self._draw_screen,
+            'intro', tuple(COLOR.BACKGROUND), self.instructions_text())
+
+    def _draw_screen(self, image):
+        image.fill(COLOR.BACKGROUND)
 
         title = TextSprite('SNAKE', pygame.Color('white'), rect_size=(SCREEN.w * 0.4, SCREEN.h * 0.2))
         title.rect.centerx = SCREEN.centerx
         title.rect.top = SCREEN.h * 0.1
-        title.draw(self.image)
+        title.draw(image)
 
-        instructions_text = f'''Move around and eat good apples to grow.
+        instructions = TextSprite(self.instructions_text(), pygame.Color('white'), rect_size=(SCREEN.w * 0.95, SCREEN.h * 0.7))
+        instructions.rect.centerx = SCREEN.centerx
+        instructions.rect.top = SCREEN.h * 0.3
+        instructions.draw(image)
+
+    @staticmethod
+    def instructions_text():
+        return f'''Move around and eat good apples to grow.
         Grow to size {WIN_SIZE} to get to the next level.
         Bad apples ain't good.
         Comlete {WIN_LEVEL} levels to win the game.
@@ -281,13 +358,10 @@ class IntroScreen:
         W, A, S, D, arrow keys: turn
         SPACEBAR: pause
         G: toggle grid lines
+        P: toggle autopilot
         ESC: quit
 
         Press any key to start'''
-        instructions = TextSprite(instructions_text, pygame.Color('white'), rect_size=(SCREEN.w * 0.95, SCREEN.h * 0.7))
-        instructions.rect.centerx = SCREEN.centerx
-        instructions.rect.top = SCREEN.h * 0.3
-        instructions.draw(self.image)
 
     def draw(self, surf):
         surf.blit(self.image, self.rect)
@@ -320,8 +394,12 @@ class OutroScreen:
         self.text.rect.top = SCREEN.h
         self.text.draw(self.image)
 
+    def scrolled(self):
+        """True when text has stopped at its final position."""
+        return self.text.rect.top <= SCREEN.h * 0.2
+
     def update(self):
-        if self.text.rect.top > SCREEN.h * 0.2:
+        if not self.scrolled():
             self.text.rect.top -= 1
             self.image.fill(COLOR.BACKGROUND)
             self.text.draw(self.image)
@@ -360,75 +438,92 @@ class StatusBar:
         screen = pygame.display.get_surface()
         self.rect = screen.get_rect()
         self.image = pygame.Surface(self.rect.size).convert()
-        font_size = max_font_size_in_rect('Size: 12  Score: 1234  Level: 12', (SCREEN.w, SCREEN.h * 0.06))
-        self.font = pygame.font.Font(None, font_size)
+        self.font_size = max_font_size_in_rect('Size: 12  Score: 1234  Level: 12', (SCREEN.w, SCREEN.h * 0.06))
         self.color = pygame.Color('white')
         self.transparent_color = (0, 0, 0)
         self.image.set_colorkey(self.transparent_color, pygame.RLEACCEL)
 
-        self.coord_size = dict(left=self.rect.w * 0.05, bottom=self.rect.bottom)
-        self.coord_score = dict(centerx=self.rect.centerx, bottom=self.rect.bottom)
-        self.coord_level = dict(right=self.rect.w * 0.95, bottom=self.rect.bottom)
-        self.coord_fps = dict(right=self.rect.w * 0.95, top=self.rect.top)
-
-        self.size_rect = self.font.render('Size: 12', True, self.color).get_rect(**self.coord_size)
-        self.score_rect = self.font.render('Score: 1234', True, self.color).get_rect(**self.coord_score)
-        self.level_rect = self.font.render('Level: 12', True, self.color).get_rect(**self.coord_level)
-        self.fps_rect = self.font.render('FPS: 12', True, self.color).get_rect(**self.coord_fps)
+        self.coords = dict(size=dict(left=self.rect.w * 0.05, bottom=self.rect.bottom),
+                           score=dict(centerx=self.rect.centerx, bottom=self.rect.bottom),
+                           level=dict(right=self.rect.w * 0.95, bottom=self.rect.bottom),
+                           fps=dict(right=self.rect.w * 0.95, top=self.rect.top))
+        samples = dict(size='Size: 12', score='Score: 1234', level='Level: 12', fps='FPS: 12')
+        self.rects = {name: render_text(text, self.font_size, self.color).get_rect(**self.coords[name])
+                      for name, text in samples.items()}
+        # currently displayed texts
+        self.texts = {}
+        # screen areas changed by update(), for dirty rect rendering
+        self.dirty = []
+
+    def _set_text(self, name, text):
+        if self.texts.get(name) == text:
+            return
+        self.texts[name] = text
+        old_rect = self.rects[name]
+        self.image.fill(self.transparent_color, old_rect)
+        surf = render_text(text, self.font_size, self.color)
+        rect = surf.get_rect(**self.coords[name])
+        self.image.blit(surf, rect)
+        self.rects[name] = rect
+        self.dirty.append(old_rect.union(rect))
 
     def update(self, size=None, score=None, level=None, fps=None):
         if size is not None:
-            self.image.fill(self.transparent_color, self.size_rect)
-            text = f'Size: {size}'
-            surf = self.font.render(text, True, self.color)
-            self.size_rect = surf.get_rect(**self.coord_size)
-            self.image.blit(surf, self.size_rect)
+            self._set_text('size', f'Size: {size}')
         if score is not None:
-            self.image.fill(self.transparent_color, self.score_rect)
-            text = f'Score: {score}'
-            surf = self.font.render(text, True, self.color)
-            self.score_rect = surf.get_rect(**self.coord_score)
-            self.image.blit(surf, self.score_rect)
+            self._set_text('score', f'Score: {score}')
         if level is not None:
-            self.image.fill(self.transparent_color, self.level_rect)
-            text = f'Level: {level}'
-            surf = self.font.render(text, True, self.color)
-            self.level_rect = surf.get_rect(**self.coord_level)
-            self.image.blit(surf, self.level_rect)
+            self._set_text('level', f'Level: {level}')
         if fps is not None:
-            self.image.fill(self.transparent_color, self.fps_rect)
-            text = f'FPS: {int(fps)}'
-            surf = self.font.render(text, True, self.color)
-            self.fps_rect = surf.get_rect(**self.coord_fps)
-            self.image.blit(surf, self.fps_rect)
+            self._set_text('fps', f'FPS: {int(fps)}')
 
     def draw(self, surf):
         surf.blit(self.image, self.rect)
 
-class Stats:
-    """Game stats: size, score, level."""
-    def __init__(self, status_bar):
-        self.status_bar = status_bar
-        self.size = START_SIZE
-        self.score = 0
-        self.level = 1
-        self.status_bar.update(size=self.size, score=self.score, level=self.level)
-
-    def level_up(self):
-        self.level += 1
-        self.size = START_SIZE
-        self.status_bar.update(size=self.size, level=self.level)
-
-    def size_up(self):
-        self.size += 1
-        self.score += self.level
-        self.status_bar.update(size=self.size, score=self.score)
-
-    def size_down(self):
-        if self.size == 1:
+class ProfileOverlay:
+    """Summary of recorded frames over the top left corner, refreshed every few frames."""
+    refresh_frames = 30
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.visible = False
+        self.font_size = max(int(SCREEN.h * 0.025), 8)
+        self.font = None
+        self.image = None
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.frames_to_refresh = 0
+        # screen areas changed by update(), for dirty rect rendering
+        self.dirty = []
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.frames_to_refresh = 0
+
+    def update(self):
+        if not self.visible:
+            return
+        self.frames_to_refresh -= 1
+        if self.frames_to_refresh > 0:
             return
-        self.size -= 1
-        self.status_bar.update(size=self.size)
+        self.frames_to_refresh = self.refresh_frames
+        if self.font is None:
+            # columns of numbers are aligned with a monospace font
+            self.font = pygame.font.SysFont('monospace', self.font_size)
+        lines = [self.font.render(line, True, (255, 255, 255)) for line in self.profiler.summary()]
+        image = pygame.Surface((max(line.get_width() for line in lines),
+                                sum(line.get_height() for line in lines))).convert()
+        image.fill((40, 40, 40))
+        top = 0
+        for line in lines:
+            image.blit(line, (0, top))
+            top += line.get_height()
+        self.dirty.append(self.rect.union(image.get_rect()))
+        self.image = image
+        self.rect = image.get_rect()
+
+    def draw(self, surf):
+        if self.visible and self.image is not None:
+            surf.blit(self.image, self.rect)
 
 
 class GameState(enum.Enum):
@@ -443,13 +538,21 @@ class GameState(enum.Enum):
 
 class Game:
     def __init__(self):
+        init_layout()
         pygame.init()
         pygame.mixer.init()
-        self.sounds = Sounds(**{'eat_good': 'assets/eat_good.ogg',
+        # sounds and music are loaded in background threads, while intro screen is shown
+        # self.assets.load_times has loading time of every file
+        self.assets = AssetLoader()
+        self.cache = DiskCache() if ASSET_CACHE else None
+        set_disk_cache(self.cache)
+        self.sounds = Sounds(loader=self.assets, cache=self.cache, **{'eat_good': 'assets/eat_good.ogg',
             'eat_bad': 'assets/eat_bad.ogg',
             'pause': 'assets/pause.ogg',
             'win_level': 'assets/win_level.ogg',
             'lose': 'assets/lose_level.ogg'})
+        for file in ('assets/intro.mid', 'assets/win_game.mid', 'assets/lose_game.mid', 'assets/level.mid'):
+            self.assets.load(file, read_bytes, file)
 
         self.clock = pygame.time.Clock()
 
@@ -458,9 +561,14 @@ class Game:
         self.ignore_input_duration = 1000
         self.ignore_input_start_time = pygame.time.get_ticks() - self.ignore_input_duration - 1
 
-        self.screen = pygame.display.set_mode(SCREEN.size)
+        if VSYNC:
+            self.screen = pygame.display.set_mode(SCREEN.size, pygame.SCALED, vsync=1)
+        else:
+            self.screen = pygame.display.set_mode(SCREEN.size)
         pygame.display.set_caption('Snake')
-        self.intro = IntroScreen()
+        self.intro = IntroScreen(self.cache)
+        self.intro.draw(self.screen)
+        pygame.display.flip()
         self.background = Background()
 
         def big_text(text):
@@ -482,43 +590,109 @@ class Game:
         self.text_level_up_press = sub_text('Press any key to continue')
 
         self.status_bar = StatusBar()
+        # frames are recorded only if begin_frame() is called, see mainloop()
+        self.profiler = FrameProfiler()
+        self.profile_overlay = ProfileOverlay(self.profiler)
+        self.apple_sprites = {True: Apple(True), False: Apple(False)}
+        # grid cells changed since last render, and what was shown at last full render
+        self.dirty_cells = set()
+        self.drawn_view = None
+        self.recorder = None
+        self.use_autopilot = AUTOPILOT
 
         self.start_new_game()
 
     def start_new_game(self):
-        pygame.mixer.music.load('assets/intro.mid')
-        pygame.mixer.music.play(-1)
+        self.play_midi('assets/intro.mid', -1)
         self.outro = OutroScreen()
-        self.stats = Stats(self.status_bar)
-        self.apples = []
+        self.engine = engine.Engine(GRID, START_SIZE, WIN_SIZE, WIN_LEVEL, GOOD_APPLES, BAD_APPLES)
+        if PROFILE:
+            self.engine.profiler = self.profiler
+        self.finish_replay()
+        if REPLAY_DIR is not None:
+            os.makedirs(REPLAY_DIR, exist_ok=True)
+            filename = os.path.join(REPLAY_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{self.engine.seed:016x}.replay')
+            self.recorder = self.engine.recorder = replay.open_recorder(filename, replay_config(), self.engine.seed)
+        self.autopilot = self.new_autopilot()
+        self.stats = self.engine.stats
+        self.update_status_bar()
         self.state = GameState.INTRO
         self.after_level_up = False
 
     def start_new_level(self):
-        self.snake = Snake((0, 0), 'n', self.stats.size, self.stats.level)
+        self.snake = Snake(self.engine.snake, self.stats.level)
+        # game time not yet consumed by steps, milliseconds
+        self.step_time = 0
         self.music.set_tempo(self.snake.speed_to_bpm())
-        self.apples = []
-        for _ in range(GOOD_APPLES):
-            self.apples.append(Apple(True, self.occupied_locs()))
-        for _ in range(BAD_APPLES):
-            self.apples.append(Apple(False, self.occupied_locs()))
         self.state = GameState.GET_READY
 
-    def occupied_locs(self):
-        """List of locations occupied by snake segments or apples."""
-        return [s.loc for s in self.snake.segs] + [a.loc for a in self.apples]
+    def finish_replay(self):
+        """Close replay of current game, if it is recorded."""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = self.engine.recorder = None
+
+    def play_midi(self, filename, loops=0):
+        """Play preloaded MIDI file with pygame.mixer.music."""
+        pygame.mixer.music.load(io.BytesIO(self.assets.get(filename)))
+        pygame.mixer.music.play(loops)
+
+    def update_status_bar(self):
+        self.profiler.begin('status bar')
+        self.status_bar.update(size=self.stats.size, score=self.stats.score, level=self.stats.level)
+        self.profiler.end()
 
     def mainloop(self):
+        prof = self.profiler
         while True:
-            self.clock.tick(60)
-            self.events()
-            self.logic()
+            timeout = self.idle_timeout()
+            event = None
+            if timeout != 0:
+                event = self.wait_event(timeout)
+            frame_time = self.clock.tick(0 if VSYNC else FPS)
+            if timeout != 0:
+                # time spent idle does not advance the game
+                frame_time = 0
+            # frame is the time spent on work, without waiting in tick()
+            if PROFILE:
+                prof.begin_frame()
+            prof.begin('events')
+            self.events([event] if event else [])
+            prof.end()
+            prof.begin('logic')
+            self.logic(frame_time)
+            prof.end()
+            prof.begin('render')
             self.render()
+            prof.end()
+            prof.end_frame()
 
 
-    def events(self):
-        for event in pygame.event.get():
+    def idle_timeout(self):
+        """Milliseconds that the loop can sleep waiting for input: 0 if something moves on screen,
+        time until input is accepted again if it is ignored, None to wait for input indefinitely.
+        """
+        # wait() with timeout is only available since pygame 2.0
+        if not IDLE_WAIT or pygame.version.vernum[0] < 2:
+            return 0
+        if self.state == GameState.RUN or (self.state == GameState.OUTRO and not self.outro.scrolled()):
+            return 0
+        if self.ignore_input:
+            return max(self.ignore_input_start_time + self.ignore_input_duration - pygame.time.get_ticks() + 1, 1)
+        return None
+
+    def wait_event(self, timeout):
+        """Block until next event, or until timeout milliseconds have passed (None for no timeout).
+        Return the event, or None on timeout.
+        """
+        event = pygame.event.wait() if timeout is None else pygame.event.wait(timeout)
+        return None if event.type == pygame.NOEVENT else event
+
+    def events(self, pending=()):
+        """Handle pending events (already taken from the queue) and events in the queue."""
+        for event in [*pending, *pygame.event.get()]:
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                self.finish_replay()
                 sys.exit()
 
             if event.type != pygame.KEYDOWN or self.ignore_input:
@@ -536,7 +710,8 @@ class Game:
 
             if self.state == GameState.INTRO:
                 pygame.mixer.music.stop()
-                self.music = MidiMusic('assets/level.mid')
+                self.music = MidiMusic(self.assets.get('assets/level.mid'), cache=self.cache)
+                self.music.prepare(speed_to_bpm(level_speed(level)) for level in range(1, WIN_LEVEL + 1))
                 self.start_new_level()
                 pygame.event.pump()
                 return
@@ -550,6 +725,8 @@ class Game:
             self._event_handle_pause(event)
             self._event_handle_dir(event)
             self._event_handle_grid(event)
+            self._event_handle_profiler(event)
+            self._event_handle_autopilot(event)
 
 
     def _event_handle_pause(self, event):
@@ -579,18 +756,42 @@ class Game:
         else:
             return
         self.snake.turn(dir_)
+        self.dirty_cells.add(self.engine.snake.segs[0])
 
         if self.state == GameState.GET_READY and dir_ != self.snake.backward:
             self.music.start()
             self.state = GameState.RUN
+            # first step right away
+            self.step_time = self.snake.step_interval
 
     def _event_handle_grid(self, event):
         if event.key == pygame.K_g:
             self.background.toggle_grid_lines()
 
-    def logic(self):
+    def _event_handle_profiler(self, event):
+        if not PROFILE:
+            return
+        if event.key == pygame.K_F3:
+            self.profile_overlay.toggle()
+        elif event.key == pygame.K_F4:
+            self.profiler.export_trace(PROFILE_TRACE)
+
+    def _event_handle_autopilot(self, event):
+        if event.key == pygame.K_p:
+            self.use_autopilot = not self.use_autopilot
+            # new bot starts from the current board
+            self.autopilot = self.new_autopilot()
+
+    def new_autopilot(self):
+        if not self.use_autopilot:
+            return None
+        return getattr(bots, AUTOPILOT_BOT)(self.engine, cache=self.cache)
+
+    def logic(self, frame_time):
+        """Update game for frame_time milliseconds passed since previous frame."""
         if self.state == GameState.GET_READY and self.after_level_up:
-            self.stats.level_up()
+            self.engine.level_up()
+            self.update_status_bar()
             self.start_new_level()
             self.after_level_up = False
 
@@ -603,71 +804,176 @@ class Game:
         if self.state != GameState.RUN:
             return
 
-        move_result = self.snake.move(self.apples)
-        if isinstance(move_result, Apple):
-            apple = move_result
-            apple.move(self.occupied_locs())
-            if apple.good:
-                self.stats.size_up()
-                self.sounds.eat_good.play()
-            else:
-                self.stats.size_down()
+        # fixed timestep: make all steps that are due, however many per frame
+        # long stalls (e.g. window dragging) are not caught up
+        self.step_time = min(self.step_time + frame_time, 250 + self.snake.step_interval)
+        while self.state == GameState.RUN and self.step_time >= self.snake.step_interval:
+            self.step_time -= self.snake.step_interval
+            self.step()
+
+        self.profiler.begin('status bar')
+        self.status_bar.update(fps=self.clock.get_fps())
+        self.profiler.end()
+
+    def step(self):
+        """Make one engine step and react to its result."""
+        head = self.engine.snake.segs[0]
+        if self.autopilot is not None:
+            self.profiler.begin('autopilot')
+            action = self.autopilot.act()
+            self.profiler.end()
+            if action is not None:
+                self.snake.turn(action)
+        self.profiler.begin('step')
+        move_result = self.engine.step()
+        self.profiler.end()
+        self.dirty_cells.add(head)
+        self.dirty_cells.update(self.engine.occ.changed)
+        if move_result in ('good', 'bad', 'level_up', 'win'):
+            if move_result == 'bad':
                 self.sounds.eat_bad.play()
+            else:
+                self.sounds.eat_good.play()
+            self.update_status_bar()
             assert self.stats.size == len(self.snake)
 
-            if len(self.snake) == WIN_SIZE:
+            if move_result in ('level_up', 'win'):
                 self.music.stop()
                 self.ignore_input = True
                 self.ignore_input_start_time = pygame.time.get_ticks()
-                if self.stats.level == WIN_LEVEL:
+                if move_result == 'win':
+                    self.finish_replay()
                     self.state = GameState.WIN
-                    pygame.mixer.music.load('assets/win_game.mid')
-                    pygame.mixer.music.play(-1)
+                    self.play_midi('assets/win_game.mid', -1)
                 else:
                     self.state = GameState.LEVEL_UP
                     self.sounds.win_level.play()
 
 
         elif move_result in ('self', 'wall', 'size_zero'):
+            self.finish_replay()
             self.state = GameState.LOSE
             self.music.stop()
             self.ignore_input = True
             self.ignore_input_start_time = pygame.time.get_ticks()
             self.sounds.lose.play()
-            pygame.mixer.music.load('assets/lose_game.mid')
-            pygame.mixer.music.play()
+            self.play_midi('assets/lose_game.mid')
 
-        self.status_bar.update(fps=self.clock.get_fps())
+    def overlay_texts(self):
+        """Texts shown over the field in current state."""
+        if self.state == GameState.PAUSE:
+            return [self.text_pause]
+        if self.state == GameState.GET_READY:
+            return [self.text_get_ready]
+        if self.state == GameState.LEVEL_UP:
+            texts = [self.text_level_up, self.text_level_up_press]
+        elif self.state == GameState.WIN:
+            texts = [self.text_win, self.text_press_restart]
+        elif self.state == GameState.LOSE:
+            texts = [self.text_lose, self.text_press_restart]
+        else:
+            return []
+        if self.ignore_input:
+            texts.pop()
+        return texts
 
     def render(self):
+        self.profiler.begin('overlay')
+        self.profile_overlay.update()
+        self.profiler.end()
+        view = (self.state, self.ignore_input, self.background.grid_lines, self.profile_overlay.visible)
+        if not DIRTY_RECTS or self.state == GameState.OUTRO or view != self.drawn_view:
+            self.render_full()
+            self.drawn_view = view
+        elif self.state != GameState.INTRO:
+            self.render_dirty()
+        self.dirty_cells.clear()
+        self.status_bar.dirty.clear()
+        self.profile_overlay.dirty.clear()
+
+    def render_full(self):
+        prof = self.profiler
         if self.state == GameState.INTRO:
             self.intro.draw(self.screen)
         elif self.state == GameState.OUTRO:
             self.outro.draw(self.screen)
         else:
+            prof.begin('background')
             self.background.draw(self.screen)
+            prof.end()
+            prof.begin('snake')
             self.snake.blit(self.screen)
-            for apple in self.apples:
-                apple.blit(self.screen)
-            if self.state == GameState.PAUSE:
-                self.text_pause.draw(self.screen)
-            elif self.state == GameState.GET_READY:
-                self.text_get_ready.draw(self.screen)
-            elif self.state == GameState.LEVEL_UP:
-                self.text_level_up.draw(self.screen)
-                if not self.ignore_input:
-                    self.text_level_up_press.draw(self.screen)
-            elif self.state == GameState.WIN:
-                self.text_win.draw(self.screen)
-                if not self.ignore_input:
-                    self.text_press_restart.draw(self.screen)
-            elif self.state == GameState.LOSE:
-                self.text_lose.draw(self.screen)
-                if not self.ignore_input:
-                    self.text_press_restart.draw(self.screen)
+            prof.end()
+            prof.begin('apples')
+            for apple in self.engine.apples:
+                if apple.cell is not None:
+                    self.draw_apple(apple)
+            prof.end()
+            prof.begin('texts')
+            for text in self.overlay_texts():
+                text.draw(self.screen)
             self.status_bar.draw(self.screen)
+            prof.end()
+        self.profile_overlay.draw(self.screen)
 
+        prof.begin('flip')
         pygame.display.flip()
+        prof.end()
+
+    def render_dirty(self):
+        """Redraw and update only changed tiles and status bar text."""
+        prof = self.profiler
+        rects = [self.tile_rect(cell) for cell in self.dirty_cells] + self.status_bar.dirty + self.profile_overlay.dirty
+        if not rects:
+            return
+        prof.begin('background')
+        for rect in rects:
+            self.screen.blit(self.background.image, rect, rect)
+        prof.end()
+        prof.begin('tiles')
+        for cell in self.cells_in_rects(rects):
+            tag = self.engine.occ[cell]
+            if tag == engine.SNAKE:
+                self.snake.blit_cell(self.screen, cell)
+            elif tag >= engine.APPLE:
+                self.draw_apple(self.engine.apples[tag - engine.APPLE])
+        prof.end()
+        prof.begin('texts')
+        for text in self.overlay_texts():
+            if text.rect.collidelist(rects) != -1:
+                text.draw(self.screen)
+        for rect in rects:
+            self.screen.blit(self.status_bar.image, rect, rect)
+        prof.end()
+        if self.profile_overlay.rect.collidelist(rects) != -1:
+            self.profile_overlay.draw(self.screen)
+        prof.begin('flip')
+        pygame.display.update(rects)
+        prof.end()
+
+    def draw_apple(self, apple):
+        sprite = self.apple_sprites[apple.good]
+        sprite.move(*GRID.xy(apple.cell))
+        sprite.blit(self.screen)
+
+    @staticmethod
+    def tile_rect(cell):
+        x, y = GRID.xy(cell)
+        return pygame.Rect(x * TILE.w, y * TILE.h, TILE.w, TILE.h)
+
+    @staticmethod
+    def cells_in_rects(rects):
+        """Set of grid cells that overlap with any of the rects."""
+        cells = set()
+        for rect in rects:
+            x0 = max(rect.left // TILE.w, 0)
+            x1 = min((rect.right - 1) // TILE.w, GRID.w - 1)
+            y0 = max(rect.top // TILE.h, 0)
+            y1 = min((rect.bottom - 1) // TILE.h, GRID.h - 1)
+            for y in range(y0, y1 + 1):
+                for x in range(x0, x1 + 1):
+                    cells.add(GRID.cell(x, y))
+        return cells
 
 
 def main():
@@ -676,5 +982,64 @@ def main():
     game.mainloop()
 
 
+def test_render_dirty(tmp_path, monkeypatch):
+    """Frames redrawn from dirty tiles match full redraws pixel for pixel, over a game
+    played by autopilot with grid lines toggled on and off.
+    """
+    import types
+    import wave
+    import mido
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    monkeypatch.setenv('SDL_AUDIODRIVER', 'dummy')
+    # placeholder assets: silent sounds, SDL_mixer tells WAV data by content whatever the
+    # file name, and one note of MIDI, that music does not play with the music player stubbed
+    os.mkdir(tmp_path / 'assets')
+    for name in ('eat_good', 'eat_bad', 'pause', 'win_level', 'lose_level'):
+        with wave.open(str(tmp_path / 'assets' / f'{name}.ogg'), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(22050)
+            f.writeframes(bytes(2000))
+    mid = mido.MidiFile()
+    mid.tracks.append(mido.MidiTrack([mido.MetaMessage('set_tempo', tempo=mido.bpm2tempo(120)),
+                                      mido.Message('note_on', note=60, velocity=64, time=0),
+                                      mido.Message('note_off', note=60, velocity=64, time=240)]))
+    for name in ('intro', 'win_game', 'lose_game', 'level'):
+        mid.save(str(tmp_path / 'assets' / f'{name}.mid'))
+    monkeypatch.chdir(tmp_path)
+    nothing = lambda *args: None
+    monkeypatch.setattr(pygame.mixer, 'music', types.SimpleNamespace(
+        load=nothing, unload=nothing, play=nothing, stop=nothing, pause=nothing, unpause=nothing,
+        set_volume=nothing, get_volume=lambda: 1.0))
+    for name, value in dict(AUTOPILOT=True, ASSET_CACHE=False, WIN_SIZE=8, WIN_LEVEL=3).items():
+        monkeypatch.setitem(globals(), name, value)
+    game = Game()
+    dirty_frames = 0
+    for frame in range(3000):
+        if game.state == GameState.OUTRO:
+            break
+        key = None
+        if game.state in (GameState.INTRO, GameState.LEVEL_UP, GameState.WIN, GameState.LOSE):
+            game.ignore_input = False
+            key = pygame.K_x
+        elif game.state == GameState.GET_READY:
+            key = pygame.K_UP
+        elif frame % 7 == 0:
+            key = pygame.K_g
+        game.events([pygame.event.Event(pygame.KEYDOWN, key=key)] if key else [])
+        game.logic(200)
+        drawn_view = game.drawn_view
+        game.render()
+        if game.state in (GameState.INTRO, GameState.OUTRO):
+            continue
+        # full render sets a new view
+        dirty_frames += game.drawn_view is drawn_view
+        shown = pygame.image.tobytes(game.screen, 'RGB')
+        game.render_full()
+        assert pygame.image.tobytes(game.screen, 'RGB') == shown, (frame, game.state)
+    assert game.state == GameState.OUTRO
+    assert dirty_frames > 100
+
+
 if __name__ == '__main__':
     main()
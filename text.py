@@ -2,36 +2,137 @@
 Text rendering.
 """
 
-import pygame
+import struct
+from collections import OrderedDict
+from functools import lru_cache
+
+from lazy import lazy_import
+
+pygame = lazy_import('pygame')
+
+@lru_cache(maxsize=128)
+def get_font(name, size):
+    """Shared Font object for font file name (None for default font) and size."""
+    return pygame.font.Font(name, size)
+
+class SurfaceCache:
+    """Least recently used cache of surfaces, bounded by total pixel memory in bytes.
+    Cached surfaces are shared and must not be drawn on.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.items = OrderedDict()
+
+    def get(self, key):
+        surf = self.items.get(key)
+        if surf is not None:
+            self.items.move_to_end(key)
+        return surf
+
+    def put(self, key, surf):
+        if key in self.items:
+            self.bytes -= self._size(self.items.pop(key))
+        self.items[key] = surf
+        self.bytes += self._size(surf)
+        while self.bytes > self.max_bytes and len(self.items) > 1:
+            _, old = self.items.popitem(last=False)
+            self.bytes -= self._size(old)
+
+    @staticmethod
+    def _size(surf):
+        return surf.get_pitch() * surf.get_height()
+
+
+# rendered lines and TextSprite images
+text_cache = SurfaceCache(16 * 2**20)
+# assets.DiskCache for TextSprite images, see set_disk_cache()
+disk_cache = None
+
+def set_disk_cache(cache):
+    """Keep rendered TextSprite images also in cache (assets.DiskCache), None to disable."""
+    global disk_cache
+    disk_cache = cache
+
+def render_text(text, font_size, color, font_name=None):
+    """Rendered antialiased line of text, shared through text_cache."""
+    color = tuple(color)
+    key = ('line', text, font_name, font_size, color)
+    surf = text_cache.get(key)
+    if surf is None:
+        surf = get_font(font_name, font_size).render(text, True, color)
+        text_cache.put(key, surf)
+    return surf
 
 def max_font_size_in_rect(text, rect_size):
-    """Return largest font size, such that rendered text would fit inside rect."""
-    font_size = 0
-    text_smaller_than_rect = True
-    while text_smaller_than_rect:
-        font_size += 1
-        font = pygame.font.Font(None, font_size)
-        w, h = font.size(text)
-        text_smaller_than_rect = (w <= rect_size[0]) and (h <= rect_size[1])
-    return font_size - 1
+    """Return largest font size, such that rendered text would fit inside rect.
+    text can also be a list of lines, each of them has to fit.
+    """
+    lines = [text] if isinstance(text, str) else text
+    def fits(font_size):
+        font = get_font(None, font_size)
+        for line in lines:
+            w, h = font.size(line)
+            if w > rect_size[0] or h > rect_size[1]:
+                return False
+        return True
+
+    # double font size until text does not fit, then bisect
+    lo, hi = 0, 1
+    while fits(hi):
+        lo, hi = hi, hi * 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
 
 
 class TextSprite:
     def __init__(self, text, color, font_size=None, rect_size=None, align='center'):
         # if rect_size is used, sprite rect will be withing that rect
         assert (font_size is None) ^ (rect_size is None)
+        # same text layout is only rendered once, sprites share the image
+        key = ('sprite', text, None, font_size, tuple(color), rect_size, align)
+        self.image = text_cache.get(key)
+        if self.image is None:
+            if disk_cache is None:
+                self.image = self._render(text, color, font_size, rect_size, align)
+            else:
+                self.image = self._load(key, lambda: self._render(text, color, font_size, rect_size, align))
+            text_cache.put(key, self.image)
+        self.rect = self.image.get_rect()
+
+    @staticmethod
+    def _load(key, render):
+        """Image from disk_cache, stored as width, height and RGBX pixels. Rendered if not there."""
+        key = disk_cache.key(pygame.version.ver, *key)
+        data = disk_cache.get(key)
+        if data is not None:
+            size = struct.unpack_from('<II', data)
+            image = pygame.image.fromstring(data[8:], size, 'RGBX').convert()
+            image.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+            return image
+        image = render()
+        disk_cache.put(key, struct.pack('<II', *image.get_size()) + pygame.image.tostring(image, 'RGBX'))
+        return image
+
+    @staticmethod
+    def _render(text, color, font_size, rect_size, align):
         text = text.split('\n')
         text = [t.strip() for t in text]
         if font_size is None:
             max_height_per_line = rect_size[1] // len(text)
             line_rect = (rect_size[0], max_height_per_line)
-            font_size = min(max_font_size_in_rect(t, line_rect) for t in text)
-        font = pygame.font.Font(None, font_size)
+            font_size = max_font_size_in_rect(text, line_rect)
+        font = get_font(None, font_size)
         sizes = [font.size(t) for t in text]
         sprite_w = max(s[0] for s in sizes)
         sprite_h = sum(s[1] for s in sizes)
-        self.image = pygame.Surface((sprite_w, sprite_h)).convert()
-        self.image.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        image = pygame.Surface((sprite_w, sprite_h)).convert()
+        image.set_colorkey((0, 0, 0), pygame.RLEACCEL)
 
         horiz = dict()
         if align == 'left':
@@ -45,11 +146,11 @@ class TextSprite:
 
         top = 0
         for t, (w, h) in zip(text, sizes):
-            line = font.render(t, True, color)
+            line = render_text(t, font_size, color)
             dest = line.get_rect(top=top, **horiz)
-            self.image.blit(line, dest)
+            image.blit(line, dest)
             top += h
-        self.rect = self.image.get_rect()
+        return image
 
     def draw(self, surf):
         surf.blit(self.image, self.rect)
@@ -63,10 +164,27 @@ def font_size_rel_to_abs(rel_size, rect=None):
 def test_max_font_size_in_rect():
     pygame.font.init()
     text = 'This Is A Test!'
-    for w in range(10, 101, 20):
-        for h in range(5, 15, 3):
+    for w in range(10, 401, 30):
+        for h in range(5, 100, 7):
             s = max_font_size_in_rect(text, (w, h))
-            print(f'Rect {(w, h)}, font {s}')
+            # same as growing font one point at a time
+            size = 1
+            while True:
+                tw, th = get_font(None, size).size(text)
+                if tw > w or th > h:
+                    break
+                size += 1
+            assert s == size - 1, (w, h, s, size - 1)
+
+def test_SurfaceCache():
+    cache = SurfaceCache(3 * 10 * 10 * 4)
+    for i in range(4):
+        cache.put(i, pygame.Surface((10, 10), depth=32))
+    assert cache.get(0) is None
+    assert cache.get(1) is not None
+    cache.put(4, pygame.Surface((10, 10), depth=32))
+    assert cache.get(1) is not None and cache.get(2) is None
+    assert cache.bytes == 3 * 10 * 10 * 4
 
 def test_TextSprite():
     pygame.init()
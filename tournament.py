@@ -0,0 +1,242 @@
+"""
+Tournament of bots over many seeds, games played without display in parallel processes.
+
+python tournament.py PathBot CycleBot --seeds 200
+python tournament.py CycleBot mybots:Greedy --grid 15x15 --grid 30x30 --wrap --out results.jsonl
+
+A policy is the name of a class in bots, or module:Class of any importable module,
+created with an engine.Engine and played with bots.play(). Jobs are (policy, seed, config)
+for every combination, config has the fields of replay.CONFIG_FIELDS, defaults are
+the game constants in rules.py. Jobs are sent to worker processes in chunks, and the
+result of every game is returned as soon as its chunk is done, printed in a summary
+per policy and grid and saved as JSON lines with --out.
+A worker process that crashes loses only the chunk it was playing, which is played
+again in a new process, and the game that crashes is reported as 'crash'.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import traceback
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import rules
+import bots
+import replay
+
+
+MAX_STEPS = 100000
+# chunks per worker, more balance the load better, fewer cost less to send
+CHUNKS_PER_WORKER = 4
+# results of games that did not end by the rules
+TIMEOUT, ERROR, CRASH = 'timeout', 'error', 'crash'
+
+# policy classes loaded in this process, by spec
+_policies = {}
+
+
+def load_policy(spec):
+    """Bot class from a name in bots or 'module:Class'."""
+    if spec not in _policies:
+        module, _, name = spec.rpartition(':')
+        _policies[spec] = getattr(importlib.import_module(module or 'bots'), name)
+    return _policies[spec]
+
+
+def play_game(policy, seed, config, max_steps=MAX_STEPS):
+    """Play one game, return result dict: policy, seed, grid, result, level, score, steps.
+    result is 'win', 'wall', 'self', 'size_zero', or TIMEOUT if max_steps ran out,
+    or ERROR if the policy raised an exception.
+    """
+    game = dict(policy=policy, seed=seed, grid=grid_name(config))
+    eng = replay.new_engine(config, seed)
+    try:
+        result, steps = bots.play(eng, load_policy(policy)(eng), max_steps)
+    except Exception:
+        game.update(result=ERROR, level=eng.stats.level, score=eng.stats.score, steps=None,
+                    error=traceback.format_exc(limit=-1).strip())
+        return game
+    if result not in ('win', 'wall', 'self', 'size_zero'):
+        result = TIMEOUT
+    game.update(result=result, level=eng.stats.level, score=eng.stats.score, steps=steps)
+    return game
+
+
+def play_chunk(jobs, max_steps=MAX_STEPS):
+    """Play (policy, seed, config) jobs in a worker, return list of result dicts."""
+    return [play_game(*job, max_steps=max_steps) for job in jobs]
+
+
+def grid_name(config):
+    return f'{config["grid_w"]}x{config["grid_h"]}{"w" if config["wrap"] else ""}'
+
+
+def chunked(jobs, size):
+    return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+
+def run(jobs, workers=None, chunk_size=None, max_steps=MAX_STEPS):
+    """Play jobs in worker processes, yield result dicts in order of completion.
+    Every worker is a pool of one process, so that a crash is traced to the chunk it ran:
+    the chunk is split in halves and played again in a new process, until the game
+    that crashes is left alone and reported as CRASH.
+    """
+    workers = workers or os.cpu_count()
+    jobs = list(jobs)
+    if chunk_size is None:
+        chunk_size = max(1, len(jobs) // (workers * CHUNKS_PER_WORKER))
+    todo = deque(chunked(jobs, chunk_size))
+    pools = [ProcessPoolExecutor(1) for _ in range(workers)]
+    # future: (worker, chunk)
+    running = {}
+    try:
+        while todo or running:
+            busy = {worker for worker, _ in running.values()}
+            for worker in range(workers):
+                if todo and worker not in busy:
+                    chunk = todo.popleft()
+                    running[pools[worker].submit(play_chunk, chunk, max_steps)] = worker, chunk
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                worker, chunk = running.pop(future)
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    pools[worker].shutdown(wait=False)
+                    pools[worker] = ProcessPoolExecutor(1)
+                    if len(chunk) > 1:
+                        half = len(chunk) // 2
+                        todo.extendleft([chunk[half:], chunk[:half]])
+                    else:
+                        policy, seed, config = chunk[0]
+                        yield dict(policy=policy, seed=seed, grid=grid_name(config), result=CRASH,
+                                   level=None, score=None, steps=None)
+                    continue
+                yield from results
+    finally:
+        for pool in pools:
+            pool.shutdown(cancel_futures=True)
+
+
+def summary(results):
+    """Lines of text: games, wins, mean level, score and steps, and end results
+    per policy and grid.
+    """
+    groups = defaultdict(list)
+    for game in results:
+        groups[game['policy'], game['grid']].append(game)
+    lines = [f'{"policy":16}{"grid":>8}{"games":>7}{"wins":>6}{"level":>7}{"score":>8}{"steps":>9}  ends']
+    for (policy, grid), games in sorted(groups.items()):
+        played = [g for g in games if g['steps'] is not None]
+        mean = lambda key: sum(g[key] for g in played) / len(played) if played else 0
+        ends = Counter(g['result'] for g in games)
+        wins = ends.pop('win', 0)
+        line = (f'{policy:16}{grid:>8}{len(games):7}{wins:6}{mean("level"):7.2f}'
+                f'{mean("score"):8.1f}{mean("steps"):9.0f}  ')
+        lines.append(line + ' '.join(f'{end}={n}' for end, n in ends.most_common()))
+    return lines
+
+
+def parse_grid(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play bots against each other over many seeds.')
+    parser.add_argument('policies', nargs='+', help='bot class in bots, or module:Class')
+    parser.add_argument('--seeds', type=int, default=100, help='number of seeds per policy and grid')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--grid', action='append', type=parse_grid,
+                        help=f'WxH, can be repeated, default {rules.GRID_W}x{rules.GRID_H}')
+    parser.add_argument('--wrap', action='store_true', help='wrap around grid edges')
+    for field in ('start_size', 'win_size', 'win_level', 'good_apples', 'bad_apples'):
+        constant = rules.REPLAY_CONFIG[field]
+        parser.add_argument(f'--{field.replace("_", "-")}', type=int, default=getattr(rules, constant),
+                            help=f'default {constant} in rules.py')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='steps before a game is given up')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--chunk-size', type=int, help='games sent to a worker at once')
+    parser.add_argument('--out', help='save result of every game to this file, JSON lines')
+    args = parser.parse_args()
+
+    for policy in args.policies:
+        load_policy(policy)
+    jobs = []
+    for grid_w, grid_h in args.grid or [(rules.GRID_W, rules.GRID_H)]:
+        config = dict(grid_w=grid_w, grid_h=grid_h, wrap=int(args.wrap), start_speed=rules.START_SPEED,
+                      **{field: getattr(args, field) for field in
+                         ('start_size', 'win_size', 'win_level', 'good_apples', 'bad_apples')})
+        for policy in args.policies:
+            for seed in range(args.first_seed, args.first_seed + args.seeds):
+                jobs.append((policy, seed, config))
+
+    out = open(args.out, 'w') if args.out else None
+    results = []
+    start = time.perf_counter()
+    try:
+        for game in run(jobs, args.workers, args.chunk_size, args.max_steps):
+            results.append(game)
+            if out is not None:
+                out.write(json.dumps(game) + '\n')
+            if game['result'] in (ERROR, CRASH):
+                print(f'{game["policy"]} seed {game["seed"]} {game["grid"]}: {game["result"]}',
+                      game.get('error', ''), file=sys.stderr)
+            print(f'\r{len(results)} / {len(jobs)} games', end='', flush=True)
+    finally:
+        if out is not None:
+            out.close()
+    seconds = time.perf_counter() - start
+    print(f'\r{len(results)} games in {seconds:.1f} s, {args.workers} workers\n')
+    print('\n'.join(summary(results)))
+
+
+class _ExitBot:
+    """Bot that ends its process in the game with seed 1, for test_run."""
+    def __init__(self, eng, cache=None):
+        if eng.seed == 1:
+            os._exit(1)
+        self.engine = eng
+
+    def act(self):
+        return None
+
+
+def test_run():
+    config = dict(grid_w=8, grid_h=6, wrap=0, start_size=3, win_size=6, win_level=2,
+                  good_apples=1, bad_apples=3, start_speed=6)
+    jobs = [(policy, seed, config) for policy in ('PathBot', 'CycleBot') for seed in range(6)]
+    results = list(run(jobs, workers=2, chunk_size=4))
+    assert sorted((g['policy'], g['seed']) for g in results) == sorted((p, s) for p, s, _ in jobs)
+    assert all(g == play_game(g['policy'], g['seed'], config) for g in results)
+    assert len(summary(results)) == 3
+    # a crashing worker loses no other games, the crashing one is reported
+    jobs = [('tournament:_ExitBot', seed, config) for seed in range(5)]
+    results = list(run(jobs, workers=2, chunk_size=2))
+    assert sorted(g['seed'] for g in results) == list(range(5))
+    assert [g['result'] for g in results if g['seed'] == 1] == [CRASH]
+    assert all(g['result'] == 'wall' for g in results if g['seed'] != 1)
+
+
+def test_main(tmp_path):
+    import subprocess
+    out = tmp_path / 'out.jsonl'
+    # runs without installed packages and without the game
+    code = ('import sys\n'
+            'sys.path = [p for p in sys.path if not p.endswith(("site-packages", "dist-packages"))]\n'
+            f'sys.argv = ["tournament.py", "PathBot", "--seeds", "2", "--grid", "8x6", "--out", {str(out)!r}]\n'
+            'import tournament\n'
+            'tournament.main()\n'
+            'assert "snake" not in sys.modules\n')
+    subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert sorted(json.loads(line)['seed'] for line in out.read_text().splitlines()) == [0, 1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Replay viewer.
+
+python viewer.py game.replay
+
+SPACEBAR: pause
+UP, DOWN: play twice faster, slower
+RIGHT, LEFT: seek 10 seconds forward, back
+PAGE UP, PAGE DOWN: seek 1 minute forward, back
+HOME, END: seek to start, end
+ESC: quit
+"""
+
+import sys
+
+import snake
+import replay
+from lazy import lazy_import
+
+pygame = lazy_import('pygame')
+
+GameState = snake.GameState
+
+
+class ReplayViewer(snake.Game):
+    """Game screen showing a recorded game instead of taking input.
+    Playback runs at speed times real time, with all steps due in a frame made
+    before the frame is rendered once.
+    """
+    def __init__(self, rep):
+        self.replay = rep
+        self.speed = 1
+        # next step to make
+        self.step_index = 0
+        snake.configure(**{snake.REPLAY_CONFIG[field]: value for field, value in rep.config.items()})
+        super().__init__()
+
+    def start_new_game(self):
+        pygame.mixer.music.stop()
+        self.engine = self.replay.new_engine()
+        self.outro = None
+        self.ignore_input = False
+        self.after_level_up = False
+        self.state = GameState.RUN
+        self.seek(0)
+
+    def seek(self, step):
+        """Show the game before given step."""
+        step = min(max(step, 0), self.replay.steps)
+        self.replay.engine_at(step, self.engine)
+        self.step_index = step
+        self.stats = self.engine.stats
+        self.snake = snake.Snake(self.engine.snake, self.stats.level)
+        self.step_time = 0
+        self.update_status_bar()
+        self.drawn_view = None
+
+    def events(self, pending=()):
+        for event in [*pending, *pygame.event.get()]:
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                sys.exit()
+            if event.type != pygame.KEYDOWN:
+                continue
+            seconds = dict([(pygame.K_RIGHT, 10), (pygame.K_LEFT, -10),
+                            (pygame.K_PAGEUP, 60), (pygame.K_PAGEDOWN, -60)])
+            if event.key == pygame.K_SPACE:
+                self.state = GameState.RUN if self.state == GameState.PAUSE else GameState.PAUSE
+            elif event.key == pygame.K_UP:
+                self.speed *= 2
+            elif event.key == pygame.K_DOWN:
+                self.speed /= 2
+            elif event.key in seconds:
+                self.seek(self.step_index + int(seconds[event.key] * self.snake.speed))
+            elif event.key == pygame.K_HOME:
+                self.seek(0)
+            elif event.key == pygame.K_END:
+                self.seek(self.replay.steps)
+            self._event_handle_grid(event)
+            self._event_handle_profiler(event)
+
+    def logic(self, frame_time):
+        if self.state == GameState.RUN:
+            self.step_time += frame_time * self.speed
+            while self.step_time >= self.snake.step_interval and self.step_index < self.replay.steps:
+                self.step_time -= self.snake.step_interval
+                self.step()
+            if self.step_index == self.replay.steps:
+                self.state = GameState.PAUSE
+        pygame.display.set_caption(f'Replay  step {self.step_index} / {self.replay.steps}  x{self.speed:g}')
+
+    def step(self):
+        """Make next recorded step."""
+        eng = self.engine
+        head = eng.snake.segs[0]
+        action = self.replay.turns.get(self.step_index)
+        if action is not None:
+            self.snake.turn(action)
+        self.profiler.begin('step')
+        result = eng.step()
+        self.profiler.end()
+        self.step_index += 1
+        self.dirty_cells.add(head)
+        self.dirty_cells.update(eng.occ.changed)
+        if result in ('good', 'bad', 'win'):
+            self.update_status_bar()
+        elif result == 'level_up':
+            eng.level_up()
+            self.snake = snake.Snake(eng.snake, self.stats.level)
+            self.update_status_bar()
+            self.drawn_view = None
+
+
+def main():
+    viewer = ReplayViewer(replay.load(sys.argv[1]))
+    viewer.mainloop()
+
+
+if __name__ == '__main__':
+    main()